@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+from datetime import datetime
+from tempfile import TemporaryDirectory
+import yaml
+from hbmqtt.broker import Broker
+from hbmqtt.client import MQTTClient
+from brick import version
+from brick.app import Application
+
+
+THROUGHPUT_TOPIC = 'benchmark'
+
+
+def get_broker_config(port):
+    return {
+        'listeners': {
+            'default': dict(type='tcp', bind='127.0.0.1:{}'.format(port)),
+        },
+        'auth': {'allow-anonymous': True, 'plugins': ['auth_anonymous']},
+        'topic-check': dict(enabled=True, plugins=['topic_taboo']),
+    }
+
+
+def get_config(args):
+    mqtt = dict(host='127.0.0.1', port=args.port, client_id='benchmark-brick', spool_size=0)
+    # Throughput events are not retained: they are never coalesced in the outbound queue
+    mqtt['policy'] = [dict(topic=THROUGHPUT_TOPIC, retain=False)]
+    if args.snapshot:
+        mqtt['snapshot'] = args.snapshot
+    return dict(
+        name='benchmark',
+        log=dict(default='warning', buffer=dict(level='warning')),
+        mqtt=mqtt,
+        devices=dict([('random{}'.format(n), dict(type='Random', delay=3600)) for n in range(args.devices)]),
+    )
+
+
+def get_stats(values):
+    if not values:
+        return None
+    values = sorted(values)
+    stats = dict(min=values[0], max=values[-1], mean=sum(values) / len(values))
+    for percentile in (50, 90, 99):
+        stats['p{}'.format(percentile)] = values[min(len(values) - 1, len(values) * percentile // 100)]
+    return stats
+
+
+class Subscriber:
+    def __init__(self, port, prefix):
+        self.uri = 'mqtt://127.0.0.1:{}/'.format(port)
+        self.prefix = prefix
+        self.client = MQTTClient(client_id='benchmark-subscriber')
+        self.messages = dict()
+        self.count = 0
+        self.last_time = None
+        self.event = asyncio.Event()
+        self.task = None
+
+    async def start(self):
+        await self.client.connect(self.uri)
+        await self.client.subscribe([('{}/+/get/#'.format(self.prefix), 0)])
+        self.task = asyncio.create_task(self.read_messages())
+
+    async def stop(self):
+        self.task.cancel()
+        await self.client.disconnect()
+
+    async def read_messages(self):
+        while True:
+            message = await self.client.deliver_message()
+            packet = message.publish_packet
+            self.messages[packet.variable_header.topic_name] = packet.payload.data
+            self.count += 1
+            self.last_time = time.perf_counter()
+            self.event.set()
+
+    async def wait_for(self, condition, timeout):
+        # Give up when no message arrives for timeout seconds
+        while not condition():
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def reset(self):
+        self.messages = dict()
+        self.count = 0
+        self.last_time = None
+
+
+def get_state_topics(app):
+    prefix = app.mqtt.prefix
+    if app.mqtt.snapshot == 'brick':
+        topics = set(['{}/brick/get/{}'.format(prefix, app.mqtt.snapshot_topic)])
+    elif app.mqtt.snapshot == 'device':
+        topics = set(['{}/{}/get/{}'.format(prefix, name, app.mqtt.snapshot_topic) for name in app.device.devices])
+    else:
+        topics = set()
+    if app.mqtt.snapshot_individual or not app.mqtt.snapshot:
+        for name, device in app.device.devices.items():
+            topics.update(['{}/{}/get/{}'.format(prefix, name, topic) for topic in device._state])
+    return topics
+
+
+async def roundtrip(app, subscriber, samples, timeout):
+    names = list(app.device.devices.keys())
+    latencies = []
+    lost = 0
+    for index in range(samples):
+        name = names[index % len(names)]
+        topic = '{}/{}/get/delay'.format(app.mqtt.prefix, name)
+        # A unique value so that the previous retained one never matches
+        payload = str(1000 + index).encode()
+        start = time.perf_counter()
+        await subscriber.client.publish('{}/{}/set/delay'.format(app.mqtt.prefix, name), payload, qos=1)
+        if await subscriber.wait_for(lambda: subscriber.messages.get(topic) == payload, timeout):
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            lost += 1
+    return dict(samples=samples, lost=lost, latency_ms=get_stats(latencies))
+
+
+async def throughput(app, subscriber, events, timeout):
+    names = list(app.device.devices.keys())
+    dropped = app.mqtt.dropped
+    subscriber.reset()
+    start = time.perf_counter()
+    for index in range(events):
+        await app.mqtt.on_event_published(names[index % len(names)], THROUGHPUT_TOPIC, index)
+    enqueued = time.perf_counter()
+    # Every event is a distinct message to the broker
+    complete = await subscriber.wait_for(lambda: subscriber.count >= events, timeout)
+    end = subscriber.last_time or enqueued
+    return dict(
+        events=events,
+        complete=complete,
+        lost=events - subscriber.count,
+        enqueue_seconds=enqueued - start,
+        events_per_second=events / (enqueued - start),
+        drain_seconds=end - start,
+        published=subscriber.count,
+        published_per_second=subscriber.count / (end - start),
+        dropped=app.mqtt.dropped - dropped,
+    )
+
+
+async def resync(app, subscriber, repeat, timeout):
+    topics = get_state_topics(app)
+    durations = []
+    messages = []
+    missing = []
+    for _ in range(repeat):
+        subscriber.reset()
+        start = time.perf_counter()
+        await app.mqtt.publish_state(delay=0)
+        await subscriber.wait_for(lambda: topics <= subscriber.messages.keys(), timeout)
+        durations.append(((subscriber.last_time or start) - start) * 1000)
+        messages.append(subscriber.count)
+        missing.append(len(topics - subscriber.messages.keys()))
+        await asyncio.sleep(timeout)
+    return dict(repeat=repeat, topics=len(topics), messages=max(messages), missing=max(missing), duration_ms=get_stats(durations))
+
+
+async def run(app, args):
+    subscriber = Subscriber(args.port, app.mqtt.prefix)
+    await subscriber.start()
+    await app.hardware.start()
+    await app.device.start()
+    await app.mqtt.start()
+    # Initial resync
+    await asyncio.sleep(1)
+    await subscriber.wait_for(lambda: False, args.timeout)
+    results = dict(
+        roundtrip=await roundtrip(app, subscriber, args.samples, args.timeout),
+        throughput=await throughput(app, subscriber, args.events, args.timeout),
+        resync=await resync(app, subscriber, args.repeat, args.timeout),
+    )
+    await app.mqtt.stop()
+    await app.device.stop()
+    await app.hardware.stop()
+    await subscriber.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Brick MQTT round-trip benchmark')
+    parser.add_argument('--devices', type=int, default=80, help='Number of simulated devices. Default: 80')
+    parser.add_argument('--samples', type=int, default=500, help='Round-trip samples. Default: 500')
+    parser.add_argument('--events', type=int, default=10000, help='Published events for throughput. Default: 10000')
+    parser.add_argument('--repeat', type=int, default=10, help='Resync repetitions. Default: 10')
+    parser.add_argument('--snapshot', choices=['device', 'brick'], help='Mqtt snapshot mode. Default: disabled')
+    parser.add_argument('--port', type=int, default=18830, help='Local broker port. Default: 18830')
+    parser.add_argument('--timeout', type=float, default=1, help='Seconds without messages before giving up a wait. Default: 1')
+    parser.add_argument('--output', default='mqtt_roundtrip.json', help='Result file. Default: mqtt_roundtrip.json')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    broker = Broker(get_broker_config(args.port))
+    loop.run_until_complete(broker.start())
+    with TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, 'config.yml'), 'w') as f:
+            yaml.safe_dump(get_config(args), f)
+        app = Application(config_dir=config_dir)
+        results = loop.run_until_complete(run(app, args))
+    loop.run_until_complete(broker.shutdown())
+    results = dict(
+        benchmark='mqtt_roundtrip',
+        timestamp=datetime.now().isoformat(),
+        brick=version,
+        python=platform.python_version(),
+        machine=platform.machine(),
+        parameters=vars(args),
+        **results
+    )
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
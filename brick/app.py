@@ -6,7 +6,7 @@ from brick.component import FakeComponent
 from brick.config import ConfigManager
 from brick.device import DeviceManager
 from brick.hardware import HardwareManager
-from brick.logging import LogCollector, StdoutLogConsumer
+from brick.logging import LogCollector, RingBufferLogConsumer, StdoutLogConsumer
 from brick.message import Dispatcher
 from brick.mqtt import Mqtt
 from brick.ntp import NtpSync
@@ -22,17 +22,38 @@ class Application:
         self.mqtt_config = self.config.get('mqtt', dict())
         # Logging
         log_config = self.config.get('log', dict())
-        self.log_collector = LogCollector()
+        self.log_collector = LogCollector(
+            buffer_size=log_config.get('queue_size', 1000),
+            exception_interval=log_config.get('exception_interval', 60),
+        )
         self.stdout_logger = StdoutLogConsumer(
             self.log_collector,
             level=log_config.get('default', 'info'),
             components=log_config.get('components', dict()),
         )
+        log_buffer_config = log_config.get('buffer', dict())
+        self.log_buffer = RingBufferLogConsumer(
+            self.log_collector,
+            size=log_buffer_config.get('size', 1000),
+            level=log_buffer_config.get('level', 'info'),
+            components=log_buffer_config.get('components', dict()),
+        )
         self.log = self.log_collector.get_logger('app')
         # ConfigManager log
         self.config_manager.set_log(self.log_collector.get_logger('config'))
         # Dispatcher
-        self.dispatcher = Dispatcher(self.log_collector.get_logger('dispatcher'))
+        dispatcher_config = self.config.get('dispatcher', dict())
+        self.dispatcher = Dispatcher(
+            self.log_collector.get_logger('dispatcher'),
+            inline=dispatcher_config.get('inline', False),
+            mailbox=dispatcher_config.get('mailbox', dict(
+                size=100,
+                # Only the last state of a topic matters, none is ever dropped
+                policy='latest',
+                # Mqtt receives the state of every device at once on publish_state
+                components=dict(mqtt=dict(size=1000)),
+            )),
+        )
         # Hardware
         try:
             self.hardware = HardwareManager(
@@ -50,6 +71,7 @@ class Application:
                 self.dispatcher,
                 self.hardware,
                 self.config.get('devices', dict()),
+                scheduler=self.config.get('scheduler', dict()),
             )
         except Exception as error:
             self.device = FakeComponent()
@@ -71,6 +93,7 @@ class Application:
                 self.dispatcher.get_broker('mqtt'),
                 name=self.name,
                 config=self.mqtt_config,
+                config_dir=self.config_manager.config_dir,
             )
         except Exception as error:
             self.mqtt = FakeComponent()
@@ -81,6 +104,7 @@ class Application:
                 log_collector=self.log_collector,
                 broker=self.dispatcher.get_broker('web'),
                 config_manager=self.config_manager,
+                log_buffer=self.log_buffer,
                 config=self.config.get('web', dict()),
             )
         except Exception as error:
@@ -93,6 +117,7 @@ class Application:
         loop.run_forever()
 
     async def run(self):
+        await self.hardware.start()
         await self.device.start()
         # await self.ntp.start()
         await self.mqtt.start()
@@ -7,6 +7,8 @@ from decimal import Decimal
 from brick import validators
 from brick.exceptions import ValidationError
 from brick.hardware.i2c import i2c_manager
+from brick.message import fast_callback
+from brick.device.scheduler import Scheduler
 
 
 def import_device_modules():
@@ -59,7 +61,7 @@ def validate_device(config, hardware_manager):
 
 
 class DeviceManager:
-    def __init__(self, log_collector, dispatcher, hardware_manager, config):
+    def __init__(self, log_collector, dispatcher, hardware_manager, config, scheduler=None):
         self.log_collector = log_collector
         self.dispatcher = dispatcher
         self.log = self.log_collector.get_logger('devicemanager')
@@ -67,12 +69,19 @@ class DeviceManager:
         self.hardware_manager = hardware_manager
         self.config = config
         self.devices = validate_device(config, self.hardware_manager)
+        self.scheduler = None
+        if scheduler is not None:
+            self.scheduler = Scheduler(self.log_collector.get_logger('scheduler'), **scheduler)
         for device_name, instance in self.devices.items():
+            instance.name = device_name
             instance.log = self.log_collector.get_logger(device_name)
             instance.broker = self.dispatcher.get_broker(device_name,callback=instance._message_received)
+            instance.scheduler = self.scheduler
 
     async def start(self):
         await i2c_manager.setup()
+        if self.scheduler:
+            self.scheduler.start()
         for name, device in self.devices.items():
             await device.start()
             await asyncio.sleep(0)
@@ -81,6 +90,8 @@ class DeviceManager:
         for device in self.devices.values():
             await device.stop()
             await asyncio.sleep(0)
+        if self.scheduler:
+            self.scheduler.stop()
 
 
 class Device:
@@ -88,6 +99,8 @@ class Device:
     hardware_config_extra = dict()
 
     def __init__(self, hardware_manager=None, hardware=None):
+        self.name = None
+        self.scheduler = None
         self.hardware_manager = hardware_manager
         self.hardware = self.validate_hardware(hardware)
 
@@ -133,9 +146,11 @@ class Device:
         assert bool(self.broker)
         # State
         self._state = dict()
+        self._snapshot = None
         self._subscriptions = dict()
         # publish_state
         self.subscribe(self.publish_state, None, 'publish_state')
+        self.subscribe(self.publish_snapshot, None, 'publish_snapshot')
         await self.setup()
 
     async def _teardown(self):
@@ -154,25 +169,38 @@ class Device:
             await asyncio.sleep(10)
 
     async def _message_received(self, sender=None, topic=None, payload=None):
-        self.log.debug('message_received from {} - {} {}'.format(sender, topic, payload))
+        self.log.debug('message_received from %s - %s %s', sender, topic, payload)
         try:
             await self.message_received(sender=sender, topic=topic, payload=payload)
         except ValidationError as error:
             self.log.warning("message from {} discarded.  {}: '{}' ({})".format(sender, topic, payload, error.message))
 
+    @fast_callback
     async def publish_state(self, **kwargs):
         self.log.debug('publish_state')
         for topic, payload in self._state.items():
             self.broker.publish(topic=topic, payload=payload)
 
+    @fast_callback
+    async def publish_snapshot(self, **kwargs):
+        self.log.debug('publish_snapshot')
+        self.broker.publish(topic='snapshot', payload=self.get_snapshot())
+
     def set_state(self, topic, payload):
-        self.log.debug('set_state {} {}'.format(topic, payload))
+        self.log.debug('set_state %s %s', topic, payload)
         self._state[topic] = payload
+        self._snapshot = None
         self.broker.publish(topic=topic, payload=payload)
 
     def get_state(self, topic):
         return self._state[topic]
 
+    def get_snapshot(self):
+        # Serialized once and reused until the state changes
+        if self._snapshot is None:
+            self._snapshot = json.dumps(self._state, default=str, separators=(',', ':'))
+        return self._snapshot
+
     def subscribe(self, callback, sender=None, topic=None):
         self.broker.subscribe(callback, sender=sender, topic=topic)
         self._subscriptions[(sender, topic)] = callback
@@ -210,6 +238,8 @@ class Sensor(Device):
         self.set_state('config_mode', json.dumps(self.config_mode))
 
     async def loop(self):
+        if self.scheduler:
+            await self.scheduler.run_every(self.name, self.set_value, lambda: self.delay, log=self.log)
         while True:
             await self.set_value()
             await asyncio.sleep(float(self.delay))
@@ -1,18 +1,124 @@
+import asyncio
+import math
+from array import array
+from operator import mul
+from brick import validators
 from brick.device import NumericSensor, register_device
+from brick.exceptions import ValidationError
 from brick.hardware.i2c import i2c_manager
 from brick.hardware.ti import ads1x15
 
 
+ADC_INPUT = dict(
+    ADS1115=ads1x15.ADS1x15Input,
+    ADS1015=ads1x15.ADS1x15Input,
+)
+ADC_MODES = ['value', 'capture', 'threshold']
+
+
+def get_waveform_stats(samples):
+    # Whole buffer passes run in C: sum, map and min/max, no per sample
+    # python code. rms and peak are computed around the mean (AC component).
+    count = len(samples)
+    mean = sum(samples) / count
+    rms = math.sqrt(max(0, sum(map(mul, samples, samples)) / count - mean * mean))
+    peak = max(max(samples) - mean, mean - min(samples))
+    return dict(
+        mean=mean,
+        rms=rms,
+        peak=peak,
+        crest=peak / rms if rms else 0,
+    )
+
+
 @register_device()
 class ADS1115(NumericSensor):
-    def __init__(self, channel=0, address=0x48, i2c_bus=0, **kwargs):
+    hardware_list = ADC_INPUT
+    window_validator = validators.DecimalValidator(name='window', precision=3, min_value=0.01, max_value=10)
+    crest_validator = validators.DecimalValidator(name='crest', precision=2)
+    high_threshold_validator = validators.DecimalValidator(name='high_threshold')
+    low_threshold_validator = validators.DecimalValidator(name='low_threshold')
+
+    def __init__(self, channel=0, address=0x48, i2c_bus=0, mode='value', window=0.2,
+                 high_threshold=None, low_threshold=None, **kwargs):
+        if mode not in ADC_MODES:
+            raise ValidationError('Mode should be one of {}'.format(ADC_MODES))
+        self.mode = mode
+        if mode == 'threshold':
+            self.hardware_config_extra = dict(comparator=True)
         super().__init__(**kwargs)
-        assert channel in (0, 1, 2 , 3)
-        self.channel = channel
-        self.voltage_conversion_factor = 4.096 / 32768
-        self.bus = i2c_manager.get_bus(i2c_bus)
-        self.adc = ads1x15.ADS1115(self.bus, address=address)
+        if mode != 'value' and self.hardware is None:
+            raise ValidationError('{} mode requires an ADS1115 or ADS1015 hardware.'.format(mode.capitalize()))
+        if self.hardware is None:
+            # Standalone single shot reads, the chip scanner is used when
+            # the device refers to an ADS1x15 hardware
+            assert channel in (0, 1, 2 , 3)
+            self.channel = channel
+            self.voltage_conversion_factor = 4.096 / 32768
+            self.bus = i2c_manager.get_bus(i2c_bus, priority='low')
+            self.adc = ads1x15.ADS1115(self.bus, address=address)
+        if mode == 'capture':
+            self.window = self.window_validator(window)
+            # Preallocated once, every capture fills it again
+            samples = max(2, int(float(self.window) * self.hardware.device.data_rate))
+            self.buffer = array('h', bytes(2 * samples))
+        if mode == 'threshold':
+            # Voltages, low_threshold gives an hysteresis
+            if high_threshold is None:
+                raise ValidationError('Threshold mode requires high_threshold.')
+            self.high_threshold = self.high_threshold_validator(high_threshold)
+            self.low_threshold = self.high_threshold
+            if low_threshold is not None:
+                self.low_threshold = self.low_threshold_validator(low_threshold)
+            if self.low_threshold > self.high_threshold:
+                raise ValidationError('low_threshold should not be greater than high_threshold.')
+            self.hardware.validate_threshold('high_threshold', self.high_threshold)
+            self.hardware.validate_threshold('low_threshold', self.low_threshold)
+
+    def validate_hardware(self, hardware, delay=None):
+        if not hardware:
+            return None
+        return super().validate_hardware(hardware)
+
+    async def setup(self):
+        await super().setup()
+        if self.hardware and self.mode == 'value':
+            # Scanned with the other channels of the chip, as often as read
+            await self.hardware.setup(interval=lambda: self.delay)
+        if self.mode == 'threshold':
+            self.set_state('high_threshold', self.high_threshold)
+            self.set_state('low_threshold', self.low_threshold)
+            await self.hardware.watch(float(self.high_threshold), float(self.low_threshold), self.threshold_received)
+
+    async def teardown(self):
+        if self.hardware:
+            await self.hardware.teardown()
+
+    async def loop(self):
+        if self.mode == 'threshold':
+            # Readings only come from the ALERT pin
+            await asyncio.get_running_loop().create_future()
+        await super().loop()
+
+    def threshold_received(self, above, voltage):
+        self.set_state('alert', 'on' if above else 'off')
+        self.sensor_previous_value = self.clean_value(voltage)
+        self.set_state('value', self.sensor_previous_value)
 
     async def get_value(self):
+        if self.mode == 'capture':
+            return await self.capture()
+        if self.hardware:
+            return await self.hardware.get_voltage()
         value = await self.adc.read_adc(self.channel)
         return value * self.voltage_conversion_factor
+
+    async def capture(self):
+        # Only the aggregates of the window are published: value is the rms
+        await self.hardware.capture(self.buffer)
+        stats = get_waveform_stats(self.buffer)
+        factor = self.hardware.get_factor()
+        self.set_state('mean', self.clean_value(stats['mean'] * factor))
+        self.set_state('peak', self.clean_value(stats['peak'] * factor))
+        self.set_state('crest', self.crest_validator(stats['crest']))
+        return stats['rms'] * factor
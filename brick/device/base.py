@@ -15,6 +15,7 @@ DIGITAL_OUTPUT = dict(
     GPIO=GPIOOutput,
     MCP23017=MCP23017Output,
 )
+BUTTON_MODES = ['auto', 'poll', 'edge']
 
 
 class SingleClickHandler:
@@ -74,12 +75,20 @@ class Button(Device):
     hardware_list = DIGITAL_INPUT
     debounce_validator = validators.IntegerValidator(name='debounce', min_value=0)
 
-    def __init__(self, debounce=50, long_click=None,
+    def __init__(self, debounce=50, long_click=None, mode='auto',
                  on_press=[], on_release=[], on_single_click=[], on_long_click=[], **kwargs):
         self.debounce = self.debounce_validator(debounce)
         self.hardware_config_extra = dict(delay=self.debounce)
         super().__init__(**kwargs)
         self.delay = self.debounce / 1000
+        if mode not in BUTTON_MODES:
+            raise ValidationError('Mode should be one of {}'.format(BUTTON_MODES))
+        if mode == 'edge' and not self.hardware.edge:
+            raise ValidationError('Hardware does not support edge mode.')
+        self.edge = mode == 'edge' or (mode == 'auto' and self.hardware.edge)
+        self.edge_state = False
+        self.settle_handle = None
+        self.long_click_handle = None
         self.on_single_click = on_single_click
         self.on_long_click = on_long_click
         self.message_lists = dict(
@@ -102,17 +111,65 @@ class Button(Device):
     async def setup(self):
         await self.hardware.setup()
 
+    async def teardown(self):
+        if self.edge:
+            await self.hardware.watch(None)
+        for handle in (self.settle_handle, self.long_click_handle):
+            if handle:
+                handle.cancel()
+
     async def loop(self):
         # If pressed on start wait until release
         while await self.hardware.is_pressed():
             await asyncio.sleep(self.delay)
+        if self.edge:
+            await self.hardware.watch(self.edge_received)
+            self.edge_received(await self.hardware.is_pressed(), time.time_ns() // 1000000)
+            await asyncio.get_running_loop().create_future()
+        if self.scheduler:
+            await self.scheduler.run_every(self.name, self.poll, self.delay, log=self.log)
         while True:
-            for event in self.handler.get_events(await self.hardware.is_pressed()):
-                self.event_handler(event)
+            await self.poll()
             await asyncio.sleep(self.delay)
 
+    async def poll(self):
+        for event in self.handler.get_events(await self.hardware.is_pressed()):
+            self.event_handler(event)
+
+    def edge_received(self, pressed, ms):
+        self.edge_state = pressed
+        # Edges within debounce ms of a change are bounces: the last one
+        # is applied when the contact settles
+        if self.settle_handle is None:
+            self.set_pressed(pressed, ms)
+
+    def settle(self):
+        self.settle_handle = None
+        if self.edge_state != self.handler.pressed:
+            self.set_pressed(self.edge_state, time.time_ns() // 1000000)
+
+    def set_pressed(self, pressed, ms):
+        events = self.handler.get_events(pressed, ms)
+        if not events:
+            return
+        loop = asyncio.get_running_loop()
+        self.settle_handle = loop.call_later(self.delay, self.settle)
+        if self.long_click_handle:
+            self.long_click_handle.cancel()
+            self.long_click_handle = None
+        if 'begin' in events and isinstance(self.handler, LongClickHandler):
+            self.long_click_handle = loop.call_later((self.handler.long_click + 1) / 1000, self.check_long_click)
+        for event in events:
+            self.event_handler(event)
+
+    def check_long_click(self):
+        self.long_click_handle = None
+        if self.handler.pressed:
+            for event in self.handler.get_events(True):
+                self.event_handler(event)
+
     def event_handler(self, event):
-        self.log.debug('click {}'.format(event))
+        self.log.debug('click %s', event)
         message_list = self.message_lists[event]
         if message_list:
             for component, topic, payload in message_list:
@@ -1,5 +1,4 @@
 import asyncio
-from smbus2_asyncio import SMBus2Asyncio
 from brick.device import Device, register_device
 from brick.hardware.i2c import i2c_manager
 
@@ -8,7 +7,7 @@ from brick.hardware.i2c import i2c_manager
 class I2CDetect(Device):
     def __init__(self, i2c_bus=0, **kwargs):
         super().__init__(**kwargs)
-        self.bus = i2c_manager.get_bus(i2c_bus)
+        self.bus = i2c_manager.get_bus(i2c_bus, priority='low')
         self.addresses = []
 
     async def setup(self):
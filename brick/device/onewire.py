@@ -1,6 +1,7 @@
 import asyncio
 import json
 from brick.device import Device, NumericSensor, register_device
+from brick.hardware.onewire import OneWireThermInput
 try:
     from brick.hardware.onewire.w1thermsensor import W1ThermSensor
 except:
@@ -23,13 +24,30 @@ class OneWireDetect(Device):
 
 @register_device()
 class DS18x20(NumericSensor):
+    hardware_list = dict(OneWire=OneWireThermInput)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    def validate_hardware(self, hardware, delay=None):
+        if not hardware:
+            return None
+        return super().validate_hardware(hardware)
+
     async def setup(self):
         await super().setup()
-        self.sensor = W1ThermSensor()
-        await self.sensor.setup()
+        if self.hardware:
+            # Converted together with the other sensors of the bus
+            await self.hardware.setup()
+        else:
+            self.sensor = W1ThermSensor()
+            await self.sensor.setup()
+
+    async def teardown(self):
+        if self.hardware:
+            await self.hardware.teardown()
 
     async def get_value(self):
+        if self.hardware:
+            return await self.hardware.get_temperature()
         return await self.sensor.get_temperature()
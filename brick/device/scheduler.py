@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import random
+from brick import validators
+
+
+GOLDEN_RATIO = 0.6180339887498949
+
+
+class Job:
+    def __init__(self, name, callback, interval, tick, phase=0, log=None):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.base_tick = tick
+        self.tick = tick
+        self.phase = phase
+        self.log = log
+        self.retry_tick = 0
+        self.task = None
+        self.runs = 0
+        self.missed = 0
+        self.report_time = None
+        self.max_lag = 0
+        self.cancelled = False
+
+    def get_interval(self):
+        return float(self.interval() if callable(self.interval) else self.interval)
+
+
+class Scheduler:
+    tick_validator = validators.DecimalValidator(name='tick', min_value=0.001)
+    jitter_validator = validators.DecimalValidator(name='jitter', min_value=0)
+    spread_validator = validators.BooleanValidator(name='spread')
+    retry_validator = validators.DecimalValidator(name='retry', min_value=0)
+
+    def __init__(self, log, tick=0.01, spread=True, jitter=0, retry=10, report_interval=60):
+        self.log = log
+        self.report_interval = report_interval
+        self.tick = float(self.tick_validator(tick))
+        # A failed job is not run again before retry seconds
+        self.retry = float(self.retry_validator(retry))
+        self.spread = self.spread_validator(spread)
+        self.jitter = int(float(self.jitter_validator(jitter)) / self.tick)
+        self.wheel = dict()
+        self.ticks = []
+        self.jobs = dict()
+        self.phases = dict()
+        self.start_time = None
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def time(self):
+        return asyncio.get_event_loop().time()
+
+    def start(self):
+        self.start_time = self.time()
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def get_tick(self):
+        return int((self.time() - self.start_time) / self.tick)
+
+    def get_ticks(self, interval):
+        return max(1, round(interval / self.tick))
+
+    def add_job(self, name, callback, interval, log=None):
+        self.remove_job(name)
+        ticks = self.get_ticks(float(interval() if callable(interval) else interval))
+        phase = 0
+        if self.spread:
+            # Successive jobs with the same interval land far from each other.
+            # The first run is not delayed, the phase shortens the second one.
+            count = self.phases.get(ticks, 0)
+            self.phases[ticks] = count + 1
+            phase = int((count * GOLDEN_RATIO) % 1 * ticks)
+        job = Job(name, callback, interval, self.get_tick() + 1, phase=phase, log=log or self.log)
+        self.jobs[name] = job
+        self.schedule(job)
+        return job
+
+    def remove_job(self, name):
+        job = self.jobs.pop(name, None)
+        if job:
+            job.cancelled = True
+
+    async def run_every(self, name, callback, interval, log=None):
+        self.add_job(name, callback, interval, log=log)
+        try:
+            await asyncio.get_event_loop().create_future()
+        finally:
+            self.remove_job(name)
+
+    def schedule(self, job):
+        job.tick = job.base_tick
+        if self.jitter:
+            job.tick += random.randint(0, self.jitter)
+        if job.tick not in self.wheel:
+            self.wheel[job.tick] = []
+            heapq.heappush(self.ticks, job.tick)
+            if self.ticks[0] == job.tick:
+                self.wakeup.set()
+        self.wheel[job.tick].append(job)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if not self.ticks:
+                await self.wakeup.wait()
+                continue
+            tick = self.ticks[0]
+            delay = self.start_time + tick * self.tick - self.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            self.run_pending(max(tick, self.get_tick()))
+
+    def run_pending(self, now=None):
+        if now is None:
+            now = self.get_tick()
+        while self.ticks and self.ticks[0] <= now:
+            tick = heapq.heappop(self.ticks)
+            for job in self.wheel.pop(tick):
+                if not job.cancelled:
+                    self.run_job(job, now)
+
+    def run_job(self, job, now):
+        ticks = self.get_ticks(job.get_interval())
+        lag = now - job.tick
+        job.max_lag = max(job.max_lag, lag)
+        job.base_tick += min(job.phase or ticks, ticks)
+        job.phase = 0
+        if job.task:
+            # Still running since the previous tick
+            self.missed_deadline(job, 1)
+        elif now < job.retry_tick:
+            # Backing off after an error
+            pass
+        else:
+            if lag >= ticks:
+                self.missed_deadline(job, lag // ticks)
+            job.task = asyncio.create_task(self.call(job))
+        if job.base_tick <= now:
+            job.base_tick += ((now - job.base_tick) // ticks + 1) * ticks
+        self.schedule(job)
+
+    def missed_deadline(self, job, missed):
+        job.missed += missed
+        now = asyncio.get_event_loop().time()
+        if job.report_time is None or now - job.report_time >= self.report_interval:
+            job.report_time = now
+            self.log.warning('Missed deadline - {} ({} missed)'.format(job.name, job.missed))
+
+    async def call(self, job):
+        try:
+            await job.callback()
+            job.runs += 1
+        except Exception as error:
+            job.log.exception('loop error', error)
+            job.retry_tick = self.get_tick() + self.get_ticks(self.retry)
+        finally:
+            job.task = None
+
+    def get_stats(self):
+        return dict([
+            (job.name, dict(interval=job.get_interval(), runs=job.runs, missed=job.missed, max_lag=job.max_lag * self.tick))
+            for job in self.jobs.values()
+        ])
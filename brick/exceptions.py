@@ -1,3 +1,7 @@
+class HardwareError(Exception):
+    """A hardware that is not set up."""
+
+
 class ValidationError(Exception):
     """An error while validating data."""
     def __init__(self, message, code=None, params=None):
@@ -4,11 +4,14 @@ import re
 import time
 from decimal import Decimal
 from brick import validators
-from brick.exceptions import ValidationError
+from brick.exceptions import HardwareError, ValidationError
+from brick.hardware.i2c import i2c_manager
 
 
 def import_hardware_modules():
     from brick.hardware.mcp import mcp230xx
+    from brick.hardware.ti import ads1x15
+    from brick.hardware import onewire
 
 
 _hardware_registry = dict()
@@ -61,16 +64,69 @@ class HardwareManager:
         self.hardware = validate_hardware(config)
         for hardware_name, instance in self.hardware.items():
             instance.log = self.log_collector.get_logger(hardware_name)
+        self.tasks = dict()
 
     async def start(self):
-        for name, hardware in self.hardware.items():
-            await hardware.setup()
-            await asyncio.sleep(0)
+        await i2c_manager.setup()
+        # Chips do not depend on each other: set them up concurrently
+        await asyncio.gather(*[self.setup_hardware(name, hardware) for name, hardware in self.hardware.items()])
+
+    async def setup_hardware(self, name, hardware):
+        try:
+            await hardware.ensure_setup()
+        except Exception as error:
+            self.log.exception('{} setup error'.format(name), error)
+            self.tasks[name] = asyncio.create_task(self.retry_setup(name, hardware))
+
+    async def retry_setup(self, name, hardware):
+        try:
+            while not hardware.ready:
+                await asyncio.sleep(hardware.setup_delay)
+                try:
+                    await hardware.ensure_setup()
+                except Exception as error:
+                    self.log.exception('{} setup error'.format(name), error)
+        finally:
+            self.tasks.pop(name, None)
 
     async def stop(self):
-        pass
+        for task in list(self.tasks.values()):
+            task.cancel()
 
 
 class Hardware:
+    # A chip whose setup failed, or whose state was lost, is set up again on
+    # next use. Until then its inputs and outputs raise HardwareError.
+    setup_min_delay = 1
+    setup_max_delay = 60
+
+    def __init__(self):
+        self.ready = False
+        self.setup_time = None
+        self.setup_delay = 0
+        self.setup_lock = asyncio.Lock()
+
     async def setup(self):
         pass
+
+    async def ensure_setup(self):
+        if self.ready:
+            return
+        async with self.setup_lock:
+            if self.ready:
+                return
+            loop = asyncio.get_running_loop()
+            if self.setup_time is not None and loop.time() - self.setup_time < self.setup_delay:
+                raise HardwareError('Not set up, next attempt in {:.0f}s'.format(self.setup_delay))
+            self.setup_time = loop.time()
+            try:
+                await self.setup()
+            except Exception:
+                self.setup_delay = min(max(self.setup_min_delay, 2 * self.setup_delay), self.setup_max_delay)
+                raise
+            self.ready = True
+            self.setup_delay = 0
+
+    def reset(self):
+        # Chip state unknown after a bus error: set up again on next use
+        self.ready = False
@@ -2,6 +2,8 @@ from brick.exceptions import ValidationError
 
 
 class DigitalInput:
+    edge = False
+
     def __init__(self, device=None, name='', delay=200):
         self.device = device
         self.name = name
@@ -17,6 +19,11 @@ class DigitalInput:
     async def get_state(self):
         raise NotImplementedError()
 
+    async def watch(self, callback):
+        # callback(pressed, ms) is called in the event loop on every edge,
+        # None stops watching
+        raise NotImplementedError()
+
 
 class DigitalOutput:
     def __init__(self, device=None, contact='no', name=''):
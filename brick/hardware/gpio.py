@@ -1,4 +1,6 @@
+import asyncio
 import gpiozero
+from time import time_ns
 from brick import validators
 from brick.hardware.base import DigitalInput, DigitalOutput
 
@@ -7,6 +9,8 @@ pin_validator = validators.IntegerValidator('pin', min_value=0)
 
 
 class GPIOInput(DigitalInput):
+    edge = True
+
     def __init__(self, pin=None, **kwargs):
         super().__init__(**kwargs)
         self.pin = pin_validator(pin)
@@ -20,6 +24,16 @@ class GPIOInput(DigitalInput):
     async def get_state(self):
         return 'on' if self.input.is_pressed else 'off'
 
+    async def watch(self, callback):
+        if callback is None:
+            self.input.when_pressed = None
+            self.input.when_released = None
+            return
+        # gpiozero calls back from its own thread
+        loop = asyncio.get_running_loop()
+        self.input.when_pressed = lambda: loop.call_soon_threadsafe(callback, True, time_ns() // 1000000)
+        self.input.when_released = lambda: loop.call_soon_threadsafe(callback, False, time_ns() // 1000000)
+
 
 class GPIOOutput(DigitalOutput):
     def __init__(self, pin=None, **kwargs):
@@ -1,22 +1,208 @@
-from smbus2_asyncio import SMBus2Asyncio
+import asyncio
+from collections import deque
+from smbus2 import SMBus, i2c_msg
+from brick.exceptions import ValidationError
+
+
+I2C_PRIORITIES = ['high', 'normal', 'low']
+I2C_M_RD = 0x0001
+
+
+class I2CBus:
+    def __init__(self, i2c_bus=0, max_wait=0.5):
+        self.i2c_bus = i2c_bus
+        self.smbus = None
+        # Lower priorities waiting longer than max_wait seconds go first
+        self.max_wait = max_wait
+        self.queues = dict([(priority, deque()) for priority in I2C_PRIORITIES])
+        self.busy = False
+        self.start_time = asyncio.get_event_loop().time()
+        self.busy_time = 0
+        self.stats = dict([(priority, dict(transactions=0, wait=0, max_wait=0)) for priority in I2C_PRIORITIES])
+
+    async def open(self):
+        if self.smbus is None:
+            self.smbus = await asyncio.get_event_loop().run_in_executor(None, SMBus, self.i2c_bus)
+
+    def get_client(self, priority='normal'):
+        if priority not in I2C_PRIORITIES:
+            raise ValidationError('Priority should be one of {}'.format(I2C_PRIORITIES))
+        return I2CClient(self, priority)
+
+    async def acquire(self, priority):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        if self.busy:
+            waiter = loop.create_future()
+            queue = self.queues[priority]
+            queue.append((start, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted while being cancelled: hand over to the next one
+                    self.release()
+                elif (start, waiter) in queue:
+                    queue.remove((start, waiter))
+                raise
+        self.busy = True
+        wait = loop.time() - start
+        stats = self.stats[priority]
+        stats['transactions'] += 1
+        stats['wait'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+
+    def release(self):
+        now = asyncio.get_event_loop().time()
+        for queue in self.queues.values():
+            # Cancelled before being granted
+            while queue and queue[0][1].done():
+                queue.popleft()
+        waiting = [queue for queue in self.queues.values() if queue]
+        if not waiting:
+            self.busy = False
+            return
+        # FIFO within a priority, starved transactions first
+        oldest = min(waiting, key=lambda queue: queue[0][0])
+        queue = oldest if now - oldest[0][0] > self.max_wait else waiting[0]
+        start, waiter = queue.popleft()
+        waiter.set_result(None)
+
+    async def run(self, priority, function, *args):
+        # function is blocking: it runs in the executor, one hop per transaction
+        await self.acquire(priority)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            return await loop.run_in_executor(None, function, *args)
+        finally:
+            self.busy_time += loop.time() - start
+            self.release()
+
+    def transfer(self, address, messages):
+        msgs = [i2c_msg.read(address, m) if isinstance(m, int) else i2c_msg.write(address, m) for m in messages]
+        self.smbus.i2c_rdwr(*msgs)
+        return [list(msg) for msg in msgs if msg.flags & I2C_M_RD]
+
+    def get_stats(self):
+        elapsed = asyncio.get_event_loop().time() - self.start_time
+        priorities = dict()
+        for priority, stats in self.stats.items():
+            priorities[priority] = dict(
+                transactions=stats['transactions'],
+                waiting=len(self.queues[priority]),
+                mean_wait=stats['wait'] / stats['transactions'] if stats['transactions'] else 0,
+                max_wait=stats['max_wait'],
+            )
+        return dict(utilization=self.busy_time / elapsed if elapsed else 0, priorities=priorities)
+
+
+class I2CClient:
+    def __init__(self, bus, priority):
+        self.bus = bus
+        self.priority = priority
+
+    async def transfer(self, address, *messages):
+        # Lists of bytes are written and integers are read lengths. All the
+        # messages go in one i2c_rdwr with repeated starts: a register read
+        # is a pointer write followed by a read. Returns the data read.
+        return await self.bus.run(self.priority, self.bus.transfer, address, messages)
+
+    async def read_byte_data(self, address, register):
+        return await self.bus.run(self.priority, self.bus.smbus.read_byte_data, address, register)
+
+    async def read_i2c_block_data(self, address, register, length):
+        data, = await self.transfer(address, [register], length)
+        return data
+
+    async def write_byte_data(self, address, register, value):
+        await self.transfer(address, [register, value])
+
+    async def write_i2c_block_data(self, address, register, data):
+        await self.transfer(address, [register] + list(data))
+
+
+class RegisterCache:
+    def __init__(self, bus, address, width=1, volatile=()):
+        # Shadow of the chip registers written or read through the bus. width
+        # is the register size in bytes: 1 for auto incremented byte registers,
+        # 2 for pointer addressed word registers. Volatile registers (inputs,
+        # conversion results) are never cached.
+        self.bus = bus
+        self.address = address
+        self.width = width
+        self.volatile = set(volatile)
+        self.values = dict()
+
+    def get(self, register):
+        return self.values.get(register)
+
+    def invalidate(self, register=None):
+        if register is None:
+            self.values = dict()
+        else:
+            self.values.pop(register, None)
+
+    def get_write(self, register, data, force=False):
+        # Smallest write covering the registers that changed, None if nothing changed
+        data = list(data)
+        values = [tuple(data[index:index + self.width]) for index in range(0, len(data), self.width)]
+        changed = [
+            index for index, value in enumerate(values)
+            if force or register + index in self.volatile or self.values.get(register + index) != value
+        ]
+        if not changed:
+            return None
+        return [register + changed[0]] + data[changed[0] * self.width:(changed[-1] + 1) * self.width]
+
+    def store(self, register, data):
+        for index in range(0, len(data), self.width):
+            if register + index // self.width not in self.volatile:
+                self.values[register + index // self.width] = tuple(data[index:index + self.width])
+
+    async def transfer(self, writes=(), reads=(), force=False):
+        writes = [self.get_write(register, data, force=force) for register, data in writes]
+        writes = [message for message in writes if message]
+        messages = list(writes)
+        for register, length in reads:
+            messages += [[register], length]
+        if not messages:
+            return []
+        try:
+            data = await self.bus.transfer(self.address, *messages)
+        except Exception:
+            # The chip state is unknown
+            self.invalidate()
+            raise
+        for message in writes:
+            self.store(message[0], message[1:])
+        for (register, length), values in zip(reads, data):
+            self.store(register, values)
+        return data
+
+    async def write(self, register, data, force=False):
+        await self.transfer(writes=[(register, data)], force=force)
+
+    async def read(self, register, length):
+        data, = await self.transfer(reads=[(register, length)])
+        return data
 
 
 class I2CManager:
     def __init__(self):
         self.bus = dict()
 
-    def get_bus(self, i2c_bus=0):
+    def get_bus(self, i2c_bus=0, priority='normal'):
         i2c_bus = int(i2c_bus)
-        if i2c_bus in self.bus:
-            return self.bus[i2c_bus]
-        else:
-            self.bus[i2c_bus] = SMBus2Asyncio(i2c_bus)
-            return self.bus[i2c_bus]
+        if i2c_bus not in self.bus:
+            self.bus[i2c_bus] = I2CBus(i2c_bus)
+        return self.bus[i2c_bus].get_client(priority)
 
     async def setup(self):
         for bus in self.bus.values():
             await bus.open()
 
-i2c_manager = I2CManager()
-
+    def get_stats(self):
+        return dict([(i2c_bus, bus.get_stats()) for i2c_bus, bus in self.bus.items()])
 
+i2c_manager = I2CManager()
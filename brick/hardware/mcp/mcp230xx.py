@@ -1,9 +1,10 @@
 import asyncio
-from copy import copy
+import gpiozero
 from time import time_ns
+from brick import validators
 from brick.exceptions import ValidationError
 from brick.hardware import Hardware, register_hardware
-from brick.hardware.i2c import i2c_manager
+from brick.hardware.i2c import RegisterCache, i2c_manager
 from brick.hardware.base import DigitalInput, DigitalOutput
 from brick.hardware.mcp import mcp230xx
 
@@ -13,9 +14,15 @@ MCP23017_DIRECTION_REGISTER = dict(a=0x00, b=0x01)  # bit 1=in 0=out
 MCP23017_PULL_UP_REGISTER = dict(a=0x0C, b=0x0D)  # bit 1 -> pup 100k
 MCP23017_INPUT_REGISTER = dict(a=0x12, b=0x13)
 MCP23017_OUTPUT_REGISTER = dict(a=0x14, b=0x15)
+MCP23017_INTERRUPT_ENABLE_REGISTER = dict(a=0x04, b=0x05)  # GPINTEN bit 1 -> interrupt on change
+MCP23017_INTERRUPT_CONTROL_REGISTER = dict(a=0x08, b=0x09)  # INTCON bit 0 -> compare with previous value
+MCP23017_CONFIGURATION_REGISTER = 0x0A  # IOCON
+MCP23017_CONFIGURATION_MIRROR = 0x40  # INTA and INTB internally connected
 
 
 class MCP23017Input(DigitalInput):
+    edge = True
+
     def __init__(self, port=None, channel=None, **kwargs):
         super().__init__(**kwargs)
         self.port = port
@@ -25,9 +32,8 @@ class MCP23017Input(DigitalInput):
     async def get_state(self):
         return await self.device.get_channel_state(self.port, self.channel, delay=self.delay)
 
-    async def setup(self):
-        await super().setup()
-        await self.device.setup()
+    async def watch(self, callback):
+        self.device.watch(self.port, self.channel, callback, delay=self.delay)
 
 
 class MCP23017Output(DigitalOutput):
@@ -43,10 +49,6 @@ class MCP23017Output(DigitalOutput):
     async def set_state(self, value):
         await self.device.set_channel_state(self.port, self.channel, self.get_contact_value(value))
 
-    async def setup(self):
-        await super().setup()
-        await self.device.setup()
-
 
 @register_hardware()
 class MCP23017(Hardware):
@@ -54,28 +56,36 @@ class MCP23017(Hardware):
     channels = list(range(8))
     directions = ['in', 'out']
 
-    def __init__(self, address=MCP230XX_DEFAULT_ADDRESS, i2c_bus=0, **kwargs):
+    interrupt_pin_validator = validators.IntegerValidator('interrupt_pin', min_value=0)
+
+    def __init__(self, address=MCP230XX_DEFAULT_ADDRESS, i2c_bus=0, interrupt_pin=None, **kwargs):
         super().__init__(**kwargs)
-        self.bus = i2c_manager.get_bus(i2c_bus)
-        self.address = address
+        # Buttons and relays go ahead of sensor reads on the bus
+        bus = i2c_manager.get_bus(i2c_bus, priority='high')
+        self.registers = RegisterCache(bus, address, volatile=MCP23017_INPUT_REGISTER.values())
+        self.interrupt_pin = None
+        if interrupt_pin is not None:
+            self.interrupt_pin = self.interrupt_pin_validator(interrupt_pin)
+        self.interrupt = None
+        self.interrupt_task = None
+        self.interrupt_pending = False
+        self.poller_task = None
+        self.watchers = dict()
         self.name = dict()
-        self.direction = dict()
+        # Shadow registers, one bit per channel
+        self.direction = dict()  # bit 1=in 0=out
         self.pullup = dict()
-        self.value = dict()
-        self.last_read_time = dict()
+        self.gpio = dict()
+        self.olat = dict()
         for port in self.ports:
             self.name[port] = dict()
-            self.direction[port] = dict()
-            self.pullup[port] = dict()
-            self.value[port] = dict()
-            self.last_read_time[port] = 0
-            for channel in self.channels:
-                self.direction[port][channel] = '0'
-                self.pullup[port][channel] = '0'
-                self.value[port][channel] = '0'
-        self.channels_reverse = copy(self.channels)
-        self.channels_reverse.reverse()
-        self.lock = asyncio.Lock()
+            self.direction[port] = 0
+            self.pullup[port] = 0
+            self.gpio[port] = 0
+            self.olat[port] = 0
+        self.last_read_time = 0
+        self.flush_task = None
+        self.olat_valid = False
 
     def channel_config(self, port, channel, name='', direction='out'):
         if port not in self.ports:
@@ -91,46 +101,133 @@ class MCP23017(Hardware):
         if direction not in self.directions:
             raise ValidationError('Direction should be one of {}'.format(self.directions))
         self.name[port][channel] = name
-        self.direction[port][channel] = '0' if direction == 'out' else '1'
-        self.pullup[port][channel] = '1' if direction == 'in' else '0'
+        if direction == 'in':
+            self.direction[port] |= 1 << channel
+            self.pullup[port] |= 1 << channel
+
+    def port_write(self, registers, values):
+        # Port a and b registers are contiguous: both go in one write
+        return (registers['a'], [values['a'], values['b']])
 
     async def setup(self):
         await super().setup()
-        for port in self.ports:
-            direction = int(''.join([self.direction[port][c] for c in self.channels_reverse]), 2)
-            pullup = int(''.join([self.pullup[port][c] for c in self.channels_reverse]), 2)
-            async with self.lock:
-                await self.bus.write_byte_data(self.address, MCP23017_DIRECTION_REGISTER[port], direction)
-                await self.bus.write_byte_data(self.address, MCP23017_PULL_UP_REGISTER[port], pullup)
-        for port in self.ports:
-            await self.read_port(port)
-
-    async def read_port(self, port):
-        async with self.lock:
-            value = await self.bus.read_byte_data(self.address, MCP23017_INPUT_REGISTER[port])
-        for c in self.channels:
-            self.value[port][c] = '1' if value & 1 << c else '0'
-        self.last_read_time[port] = time_ns()
-
-    async def write_port(self, port):
-        async with self.lock:
-            await self.bus.write_byte_data(
-                self.address,
-                MCP23017_OUTPUT_REGISTER[port],
-                int(''.join([self.value[port][c] for c in self.channels_reverse]), 2),
-            )
+        writes = []
+        if self.interrupt_pin is not None:
+            writes.append((MCP23017_CONFIGURATION_REGISTER, [MCP23017_CONFIGURATION_MIRROR]))
+        writes.append(self.port_write(MCP23017_DIRECTION_REGISTER, self.direction))
+        writes.append(self.port_write(MCP23017_PULL_UP_REGISTER, self.pullup))
+        if self.interrupt_pin is not None:
+            writes.append(self.port_write(MCP23017_INTERRUPT_CONTROL_REGISTER, dict(a=0, b=0)))
+            writes.append(self.port_write(MCP23017_INTERRUPT_ENABLE_REGISTER, self.direction))
+        if self.olat_valid:
+            # Set up again after a bus error: restore the outputs
+            writes.append(self.port_write(MCP23017_OUTPUT_REGISTER, self.olat))
+        # Outputs keep their current value
+        reads = [(MCP23017_OUTPUT_REGISTER['a'], 2), (MCP23017_INPUT_REGISTER['a'], 2)]
+        # The whole configuration in a single bus transaction, registers
+        # already holding the right value are skipped
+        olat, gpio = await self.registers.transfer(writes=writes, reads=reads)
+        for port, olat_value, gpio_value in zip(self.ports, olat, gpio):
+            self.olat[port] = olat_value
+            self.gpio[port] = gpio_value
+        self.olat_valid = True
+        self.last_read_time = time_ns()
+        if self.interrupt_pin is not None and self.interrupt is None:
+            # INT is active low: it is released as soon as the ports are read
+            loop = asyncio.get_running_loop()
+            self.interrupt = gpiozero.Button(self.interrupt_pin)
+            self.interrupt.when_pressed = lambda: loop.call_soon_threadsafe(self.interrupt_received)
+            if self.interrupt.is_pressed:
+                # Changed since the ports were read
+                self.interrupt_received()
+        self.ready = True
+
+    def watch(self, port, channel, callback, delay=200):
+        if callback is None:
+            self.watchers.pop((port, channel), None)
+        else:
+            self.watchers[(port, channel)] = (callback, delay)
+        if self.interrupt_pin is None:
+            # Without interrupts a single poller serves every watched channel
+            if self.watchers and self.poller_task is None:
+                self.poller_task = asyncio.create_task(self.poller())
+            if not self.watchers and self.poller_task:
+                self.poller_task.cancel()
+                self.poller_task = None
+
+    async def poller(self):
+        while True:
+            try:
+                await self.read_ports()
+            except Exception as error:
+                self.log.exception('poller', error)
+            await asyncio.sleep(min([delay for callback, delay in self.watchers.values()]) / 1000)
+
+    def interrupt_received(self):
+        self.interrupt_pending = True
+        if self.interrupt_task is None:
+            self.interrupt_task = asyncio.create_task(self.read_interrupt())
+
+    async def read_interrupt(self):
+        try:
+            while self.interrupt_pending:
+                self.interrupt_pending = False
+                await self.read_ports()
+        except Exception as error:
+            self.log.exception('interrupt', error)
+        finally:
+            self.interrupt_task = None
+
+    async def read_ports(self, notify=True):
+        await self.ensure_setup()
+        # GPIOA and GPIOB in one sequential read
+        try:
+            data = await self.registers.read(MCP23017_INPUT_REGISTER['a'], 2)
+        except Exception:
+            self.reset()
+            raise
+        self.last_read_time = time_ns()
+        ms = self.last_read_time // 1000000
+        for port, value in zip(self.ports, data):
+            changed = value ^ self.gpio[port]
+            self.gpio[port] = value
+            if notify and changed:
+                for channel in self.channels:
+                    if changed & 1 << channel:
+                        watcher = self.watchers.get((port, channel))
+                        if watcher:
+                            watcher[0](not value & 1 << channel, ms)
+
+    async def flush(self):
+        # Let every change made in the same loop iteration join this write
+        await asyncio.sleep(0)
+        self.flush_task = None
+        # Only the ports that changed are written
+        try:
+            await self.registers.write(*self.port_write(MCP23017_OUTPUT_REGISTER, self.olat))
+        except Exception:
+            self.reset()
+            raise
 
     async def get_channel_state(self, port, channel, delay=200):
-        half_delay_ns = delay * 500000
-        if time_ns() - self.last_read_time[port] > half_delay_ns:
-            await self.read_port(port)
-        if self.direction[port][channel] == '1':
+        await self.ensure_setup()
+        mask = 1 << channel
+        if self.direction[port] & mask:
             # direction in
-            return 'on' if self.value[port][channel] == '0' else 'off'
+            half_delay_ns = delay * 500000
+            if self.poller_task is None and time_ns() - self.last_read_time > half_delay_ns:
+                await self.read_ports()
+            return 'on' if not self.gpio[port] & mask else 'off'
         else:
             # direction out
-            return 'on' if self.value[port][channel] == '1' else 'off'
+            return 'on' if self.olat[port] & mask else 'off'
 
     async def set_channel_state(self, port, channel, state):
-        self.value[port][channel] = '1' if state == 'on' else '0'
-        await self.write_port(port)
+        await self.ensure_setup()
+        if state == 'on':
+            self.olat[port] |= 1 << channel
+        else:
+            self.olat[port] &= ~(1 << channel)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+        await asyncio.shield(self.flush_task)
@@ -0,0 +1,121 @@
+import asyncio
+import os
+from brick import validators
+from brick.exceptions import ValidationError
+from brick.hardware import Hardware, register_hardware
+
+
+W1_BASE_DIRECTORY = '/sys/bus/w1/devices'
+W1_THERM_FAMILIES = ['10', '22', '28', '3b', '42']
+W1_BULK_READ_IN_PROGRESS = -1
+
+
+class OneWireThermInput:
+    def __init__(self, device=None, sensor_id=None, name=''):
+        self.device = device
+        self.sensor_id = sensor_id
+        self.name = name
+
+    async def setup(self):
+        if self.sensor_id is None:
+            # First sensor found on the bus
+            sensors = await self.device.get_sensors()
+            if not sensors:
+                raise ValidationError('No 1-Wire temperature sensor found.')
+            self.sensor_id = sensors[0]
+        self.device.attach(self.sensor_id)
+
+    async def teardown(self):
+        self.device.detach(self.sensor_id)
+
+    async def get_temperature(self):
+        return await self.device.get_temperature(self.sensor_id)
+
+
+@register_hardware('OneWire')
+class OneWireBus(Hardware):
+    # One simultaneous conversion for every sensor of the bus, then each
+    # sensor result is read without a conversion of its own
+    timeout_validator = validators.DecimalValidator('timeout', min_value=0)
+    max_age_validator = validators.DecimalValidator('max_age', min_value=0)
+
+    def __init__(self, master='w1_bus_master1', base_directory=W1_BASE_DIRECTORY, timeout=2, max_age=2, **kwargs):
+        super().__init__(**kwargs)
+        self.base_directory = base_directory
+        self.master_directory = os.path.join(base_directory, master)
+        self.timeout = float(self.timeout_validator(timeout))
+        self.max_age = float(self.max_age_validator(max_age))
+        self.sensors = set()
+        self.conversion = None
+        self.conversion_time_end = None
+
+    def attach(self, sensor_id):
+        self.sensors.add(sensor_id)
+
+    def detach(self, sensor_id):
+        self.sensors.discard(sensor_id)
+
+    async def get_sensors(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_sensors_sync)
+
+    def get_sensors_sync(self):
+        with open(os.path.join(self.master_directory, 'w1_master_slaves')) as f:
+            slaves = f.read().split()
+        return [slave for slave in slaves if slave.split('-')[0] in W1_THERM_FAMILIES]
+
+    async def get_temperature(self, sensor_id):
+        # Sensors read within max_age seconds share the same conversion
+        loop = asyncio.get_running_loop()
+        if self.conversion is None or (self.conversion.done() and loop.time() - self.conversion_time_end > self.max_age):
+            self.conversion = asyncio.create_task(self.convert())
+        temperatures = await asyncio.shield(self.conversion)
+        if sensor_id not in temperatures:
+            # Attached after the conversion started
+            self.conversion = None
+            return await self.get_temperature(sensor_id)
+        temperature = temperatures[sensor_id]
+        if isinstance(temperature, Exception):
+            raise temperature
+        return temperature
+
+    async def convert(self):
+        loop = asyncio.get_running_loop()
+        sensors = list(self.sensors)
+        try:
+            if os.path.exists(os.path.join(self.master_directory, 'therm_bulk_read')):
+                await loop.run_in_executor(None, self.write_master, 'therm_bulk_read', 'trigger')
+                deadline = loop.time() + self.timeout
+                while int(await loop.run_in_executor(None, self.read_master, 'therm_bulk_read')) == W1_BULK_READ_IN_PROGRESS:
+                    if loop.time() > deadline:
+                        raise asyncio.TimeoutError('1-Wire bulk conversion timeout')
+                    await asyncio.sleep(0.05)
+                return await loop.run_in_executor(None, self.read_temperatures, sensors, 'temperature')
+            # Kernel without bulk read: one conversion per sensor
+            return await loop.run_in_executor(None, self.read_temperatures, sensors, 'w1_slave')
+        finally:
+            self.conversion_time_end = loop.time()
+
+    def write_master(self, name, value):
+        with open(os.path.join(self.master_directory, name), 'w') as f:
+            f.write(value)
+
+    def read_master(self, name):
+        with open(os.path.join(self.master_directory, name)) as f:
+            return f.read()
+
+    def read_temperatures(self, sensors, name):
+        # Every sensor in the same executor call
+        temperatures = dict()
+        for sensor_id in sensors:
+            try:
+                with open(os.path.join(self.base_directory, sensor_id, name)) as f:
+                    text = f.read()
+                if name == 'w1_slave':
+                    lines = text.splitlines()
+                    if not lines[0].strip().endswith('YES'):
+                        raise ValueError('Sensor {} not ready'.format(sensor_id))
+                    text = lines[1].split('t=')[1]
+                temperatures[sensor_id] = int(text) / 1000
+            except Exception as error:
+                temperatures[sensor_id] = error
+        return temperatures
@@ -20,6 +20,11 @@
 # THE SOFTWARE.
 
 import asyncio
+import gpiozero
+from brick import validators
+from brick.exceptions import ValidationError
+from brick.hardware import Hardware, register_hardware
+from brick.hardware.i2c import RegisterCache, i2c_manager
 
 
 # Register and other configuration values:
@@ -79,6 +84,7 @@ class ADS1x15(object):
     def __init__(self, bus, address=ADS1x15_DEFAULT_ADDRESS):
         self.bus = bus
         self.address = address
+        self.registers = RegisterCache(bus, address, width=2, volatile=[ADS1x15_POINTER_CONVERSION])
 
     def _data_rate_default(self):
         """Retrieve the default data rate for this ADC (in samples per second).
@@ -101,9 +107,9 @@ class ADS1x15(object):
         """
         raise NotImplementedError('Subclass must implement _conversion_value function!')
 
-    async def _read(self, mux, gain, data_rate, mode):
-        """Perform an ADC read with the provided mux, gain, data_rate, and mode
-        values.  Returns the signed integer result of the read.
+    def _config_value(self, mux, gain, data_rate, mode):
+        """Build the config register value for the provided mux, gain,
+        data_rate and mode values, comparator bits excluded.
         """
         config = ADS1x15_CONFIG_OS_SINGLE  # Go out of power-down mode for conversion.
         # Specify mux value.
@@ -121,15 +127,30 @@ class ADS1x15(object):
         # Set the data rate (this is controlled by the subclass as it differs
         # between ADS1015 and ADS1115).
         config |= self._data_rate_config(data_rate)
+        return config
+
+    async def _write_config(self, config, mode):
+        # Explicitly break the 16-bit value down to a big endian pair of bytes.
+        # A single shot conversion is started by every write, a continuous
+        # one only needs a write when the config changes.
+        await self.registers.write(ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF],
+                                   force=mode == ADS1x15_CONFIG_MODE_SINGLE)
+
+    async def _read(self, mux, gain, data_rate, mode):
+        """Perform an ADC read with the provided mux, gain, data_rate, and mode
+        values.  Returns the signed integer result of the read.
+        """
+        config = self._config_value(mux, gain, data_rate, mode)
         config |= ADS1x15_CONFIG_COMP_QUE_DISABLE  # Disble comparator mode.
+        if data_rate is None:
+            data_rate = self._data_rate_default()
         # Send the config value to start the ADC conversion.
-        # Explicitly break the 16-bit value down to a big endian pair of bytes.
-        await self.bus.write_i2c_block_data(self.address, ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
+        await self._write_config(config, mode)
         # Wait for the ADC sample to finish based on the sample rate plus a
         # small offset to be sure (0.1 millisecond).
         await asyncio.sleep(1.0/data_rate+0.0001)
-        # Retrieve the result.
-        result = await self.bus.read_i2c_block_data(self.address, ADS1x15_POINTER_CONVERSION, 2)
+        # Retrieve the result: pointer write and read in one transfer.
+        result = await self.registers.read(ADS1x15_POINTER_CONVERSION, 2)
         return self._conversion_value(result[1], result[0])
 
     async def _read_comparator(self, mux, gain, data_rate, mode, high_threshold,
@@ -141,25 +162,12 @@ class ADS1x15(object):
         """
         assert num_readings == 1 or num_readings == 2 or num_readings == 4, 'Num readings must be 1, 2, or 4!'
         # Set high and low threshold register values.
-        await self.bus.write_i2c_block_data(self.address, ADS1x15_POINTER_HIGH_THRESHOLD, [(high_threshold >> 8) & 0xFF, high_threshold & 0xFF])
-        await self.bus.write_i2c_block_data(self.address, ADS1x15_POINTER_LOW_THRESHOLD, [(low_threshold >> 8) & 0xFF, low_threshold & 0xFF])
+        await self.registers.write(ADS1x15_POINTER_HIGH_THRESHOLD, [(high_threshold >> 8) & 0xFF, high_threshold & 0xFF])
+        await self.registers.write(ADS1x15_POINTER_LOW_THRESHOLD, [(low_threshold >> 8) & 0xFF, low_threshold & 0xFF])
         # Now build up the appropriate config register value.
-        config = ADS1x15_CONFIG_OS_SINGLE  # Go out of power-down mode for conversion.
-        # Specify mux value.
-        config |= (mux & 0x07) << ADS1x15_CONFIG_MUX_OFFSET
-        # Validate the passed in gain and then set it in the config.
-        if gain not in ADS1x15_CONFIG_GAIN:
-            raise ValueError('Gain must be one of: 2/3, 1, 2, 4, 8, 16')
-        config |= ADS1x15_CONFIG_GAIN[gain]
-        # Set the mode (continuous or single shot).
-        config |= mode
-        # Get the default data rate if none is specified (default differs between
-        # ADS1015 and ADS1115).
+        config = self._config_value(mux, gain, data_rate, mode)
         if data_rate is None:
             data_rate = self._data_rate_default()
-        # Set the data rate (this is controlled by the subclass as it differs
-        # between ADS1015 and ADS1115).
-        config |= self._data_rate_config(data_rate)
         # Enable window mode if required.
         if not traditional:
             config |= ADS1x15_CONFIG_COMP_WINDOW
@@ -172,14 +180,13 @@ class ADS1x15(object):
         # Set number of comparator hits before alerting.
         config |= ADS1x15_CONFIG_COMP_QUE[num_readings]
         # Send the config value to start the ADC conversion.
-        # Explicitly break the 16-bit value down to a big endian pair of bytes.
-        await self.bus.write_i2c_block_data(self.address, ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
+        await self._write_config(config, mode)
         # Wait for the ADC sample to finish based on the sample rate plus a
         # small offset to be sure (0.1 millisecond).
-        time.sleep(1.0/data_rate+0.0001)
+        await asyncio.sleep(1.0/data_rate+0.0001)
         # Retrieve the result.
-        result = await self.bus.read_i2c_block_data(self.address, ADS1x15_POINTER_CONVERSION, 2)
-        return self._conversion_value(result[1], result[0], gain)
+        result = await self.registers.read(ADS1x15_POINTER_CONVERSION, 2)
+        return self._conversion_value(result[1], result[0])
 
     async def read_adc(self, channel, gain=1, data_rate=None):
         """Read a single ADC channel and return the ADC value as a signed integer
@@ -202,7 +209,7 @@ class ADS1x15(object):
         assert 0 <= differential <= 3, 'Differential must be a value within 0-3!'
         # Perform a single shot read using the provided differential value
         # as the mux value (which will enable differential mode).
-        return self._read(differential, gain, data_rate, ADS1x15_CONFIG_MODE_SINGLE)
+        return await self._read(differential, gain, data_rate, ADS1x15_CONFIG_MODE_SINGLE)
 
     async def start_adc(self, channel, gain=1, data_rate=None):
         """Start continuous ADC conversions on the specified channel (0-3). Will
@@ -213,7 +220,7 @@ class ADS1x15(object):
         assert 0 <= channel <= 3, 'Channel must be a value within 0-3!'
         # Start continuous reads and set the mux value to the channel plus
         # the highest bit (bit 3) set.
-        return self._read(channel + 0x04, gain, data_rate, ADS1x15_CONFIG_MODE_CONTINUOUS)
+        return await self._read(channel + 0x04, gain, data_rate, ADS1x15_CONFIG_MODE_CONTINUOUS)
 
     async def start_adc_difference(self, differential, gain=1, data_rate=None):
         """Start continuous ADC conversions between two ADC channels. Differential
@@ -229,7 +236,7 @@ class ADS1x15(object):
         assert 0 <= differential <= 3, 'Differential must be a value within 0-3!'
         # Perform a single shot read using the provided differential value
         # as the mux value (which will enable differential mode).
-        return self._read(differential, gain, data_rate, ADS1x15_CONFIG_MODE_CONTINUOUS)
+        return await self._read(differential, gain, data_rate, ADS1x15_CONFIG_MODE_CONTINUOUS)
 
     async def start_adc_comparator(self, channel, high_threshold, low_threshold,
                              gain=1, data_rate=None, active_low=True,
@@ -257,10 +264,10 @@ class ADS1x15(object):
         assert 0 <= channel <= 3, 'Channel must be a value within 0-3!'
         # Start continuous reads with comparator and set the mux value to the
         # channel plus the highest bit (bit 3) set.
-        return self._read_comparator(channel + 0x04, gain, data_rate,
-                                     ADS1x15_CONFIG_MODE_CONTINUOUS,
-                                     high_threshold, low_threshold, active_low,
-                                     traditional, latching, num_readings)
+        return await self._read_comparator(channel + 0x04, gain, data_rate,
+                                           ADS1x15_CONFIG_MODE_CONTINUOUS,
+                                           high_threshold, low_threshold, active_low,
+                                           traditional, latching, num_readings)
 
     async def start_adc_difference_comparator(self, differential, high_threshold, low_threshold,
                                         gain=1, data_rate=None, active_low=True,
@@ -289,10 +296,10 @@ class ADS1x15(object):
         assert 0 <= differential <= 3, 'Differential must be a value within 0-3!'
         # Start continuous reads with comparator and set the mux value to the
         # channel plus the highest bit (bit 3) set.
-        return self._read_comparator(differential, gain, data_rate,
-                                     ADS1x15_CONFIG_MODE_CONTINUOUS,
-                                     high_threshold, low_threshold, active_low,
-                                     traditional, latching, num_readings)
+        return await self._read_comparator(differential, gain, data_rate,
+                                           ADS1x15_CONFIG_MODE_CONTINUOUS,
+                                           high_threshold, low_threshold, active_low,
+                                           traditional, latching, num_readings)
 
     async def stop_adc(self):
         """Stop all continuous ADC conversions (either normal or difference mode).
@@ -300,7 +307,7 @@ class ADS1x15(object):
         # Set the config register to its default value of 0x8583 to stop
         # continuous conversions.
         config = 0x8583
-        await self.bus.write_i2c_block_data(self.address, ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
+        await self.registers.write(ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
 
     async def get_last_result(self):
         """Read the last conversion result when in continuous conversion mode.
@@ -308,7 +315,7 @@ class ADS1x15(object):
         """
         # Retrieve the conversion register value, convert to a signed int, and
         # return it.
-        result = await self.bus.read_i2c_block_data(self.address, ADS1x15_POINTER_CONVERSION, 2)
+        result = await self.registers.read(ADS1x15_POINTER_CONVERSION, 2)
         return self._conversion_value(result[1], result[0])
 
 
@@ -358,3 +365,314 @@ class ADS1015(ADS1x15):
         if value & 0x800 != 0:
             value -= 1 << 12
         return value
+
+
+# Full scale range in volts for each gain
+ADS1x15_GAIN_VOLTAGE = {
+    2/3: 6.144,
+    1:   4.096,
+    2:   2.048,
+    4:   1.024,
+    8:   0.512,
+    16:  0.256
+}
+# ALERT/RDY pin pulses after each conversion with these thresholds
+ADS1x15_READY_HIGH_THRESHOLD = 0x8000
+ADS1x15_READY_LOW_THRESHOLD = 0x0000
+ADS1x15_SCAN_INTERVAL = 1
+
+
+class ADS1x15Input:
+    def __init__(self, device=None, channel=0, gain=1, comparator=False, name=''):
+        self.device = device
+        self.channel = channel
+        self.gain = gain
+        self.comparator = comparator
+        self.name = name
+        self.device.channel_config(channel, gain=gain, comparator=comparator, name=name)
+
+    async def setup(self, interval=None):
+        # interval: seconds between readings of the consumer, or a callable
+        self.device.attach(self.channel, interval)
+
+    async def teardown(self):
+        if self.comparator:
+            await self.device.stop_comparator()
+        else:
+            self.device.detach(self.channel)
+
+    async def watch(self, high, low, callback):
+        # callback(above, voltage) is called on every threshold crossing
+        await self.device.start_comparator(self.channel, high, low, callback)
+
+    async def get_voltage(self):
+        return await self.device.get_voltage(self.channel)
+
+    async def capture(self, buffer):
+        await self.device.capture(self.channel, buffer)
+
+    def get_factor(self):
+        return self.device.get_factor(self.channel)
+
+    def validate_threshold(self, name, voltage):
+        return self.device.validate_threshold(self.channel, name, voltage)
+
+
+class ADS1x15Scanner(Hardware):
+    # One scan engine per chip owns the mux and cycles through the channels
+    adc_class = None
+    channels = [0, 1, 2, 3]
+    max_value = None
+    threshold_shift = 0
+
+    alert_pin_validator = validators.IntegerValidator('alert_pin', min_value=0)
+    interval_validator = validators.DecimalValidator('interval', min_value=0)
+
+    def __init__(self, address=ADS1x15_DEFAULT_ADDRESS, i2c_bus=0, data_rate=None, alert_pin=None, interval=None, **kwargs):
+        super().__init__(**kwargs)
+        self.bus = i2c_manager.get_bus(i2c_bus, priority='low')
+        self.adc = self.adc_class(self.bus, address=address)
+        self.data_rate = data_rate or self.adc._data_rate_default()
+        try:
+            self.adc._data_rate_config(self.data_rate)
+        except ValueError as error:
+            raise ValidationError(str(error))
+        self.alert_pin = None
+        if alert_pin is not None:
+            self.alert_pin = self.alert_pin_validator(alert_pin)
+        # Seconds between scans, by default the shortest interval of the
+        # attached channels
+        self.interval = None
+        if interval is not None:
+            self.interval = float(self.interval_validator(interval))
+        self.alert = None
+        self.ready = None
+        self.gains = dict()
+        self.names = dict()
+        self.attached = dict()
+        self.values = dict()
+        self.sample = None
+        self.task = None
+        self.lock = asyncio.Lock()
+        self.comparator_channel = None
+        self.comparator = None
+        self.comparator_above = False
+        self.comparator_pending = False
+        self.comparator_task = None
+
+    def channel_config(self, channel, gain=1, comparator=False, name=''):
+        if channel not in self.channels:
+            raise ValidationError('Channel should be one of {}'.format(self.channels))
+        if gain not in ADS1x15_CONFIG_GAIN:
+            raise ValidationError('Gain should be one of {}'.format(list(ADS1x15_CONFIG_GAIN.keys())))
+        if channel in self.names:
+            raise ValidationError("Channel {} already used by '{}'".format(channel, self.names[channel]))
+        if comparator and self.alert_pin is None:
+            raise ValidationError('The comparator requires an alert_pin.')
+        if self.comparator_channel is not None or (comparator and self.names):
+            # The comparator watches the mux continuously
+            raise ValidationError('The comparator requires a chip of its own.')
+        if comparator:
+            self.comparator_channel = channel
+        self.names[channel] = name
+        self.gains[channel] = gain
+
+    async def setup(self):
+        await super().setup()
+        self.ready = asyncio.Event()
+        if self.alert_pin is not None and self.alert is None:
+            if self.comparator_channel is None:
+                await self.adc.registers.write(ADS1x15_POINTER_HIGH_THRESHOLD, [ADS1x15_READY_HIGH_THRESHOLD >> 8, 0])
+                await self.adc.registers.write(ADS1x15_POINTER_LOW_THRESHOLD, [ADS1x15_READY_LOW_THRESHOLD >> 8, 0])
+            loop = asyncio.get_running_loop()
+            self.alert = gpiozero.Button(self.alert_pin)
+            self.alert.when_pressed = lambda: loop.call_soon_threadsafe(self.alert_received)
+
+    def alert_received(self):
+        self.ready.set()
+        if self.comparator:
+            self.comparator_pending = True
+            if self.comparator_task is None:
+                self.comparator_task = asyncio.create_task(self.read_comparator())
+
+    def attach(self, channel, interval=None):
+        self.attached[channel] = interval
+        if self.task is None:
+            self.task = asyncio.create_task(self.scan())
+
+    def detach(self, channel):
+        self.attached.pop(channel, None)
+        self.values.pop(channel, None)
+        if not self.attached and self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def scan(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            try:
+                for channel in sorted(self.attached):
+                    async with self.lock:
+                        self.values[channel] = await self.convert(channel)
+                    if self.sample:
+                        self.sample.set_result(None)
+                        self.sample = None
+            except Exception as error:
+                self.log.exception('scan', error)
+                await asyncio.sleep(1)
+            await asyncio.sleep(max(0, self.get_interval() - (loop.time() - start)))
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        intervals = [float(i() if callable(i) else i) for i in self.attached.values() if i is not None]
+        return min(intervals) if intervals else ADS1x15_SCAN_INTERVAL
+
+    def get_continuous_config(self, channel):
+        config = self.adc._config_value(channel + 0x04, self.gains[channel], self.data_rate, ADS1x15_CONFIG_MODE_CONTINUOUS)
+        if self.alert:
+            config |= ADS1x15_CONFIG_COMP_QUE[1]
+        else:
+            config |= ADS1x15_CONFIG_COMP_QUE_DISABLE
+        return [(config >> 8) & 0xFF, config & 0xFF]
+
+    async def start_continuous(self, channel):
+        data = self.get_continuous_config(channel)
+        if self.adc.registers.get(ADS1x15_POINTER_CONFIG) != tuple(data):
+            await self.adc.registers.write(ADS1x15_POINTER_CONFIG, data)
+            # The conversion in progress still uses the previous channel
+            await self.wait_conversion()
+
+    async def convert(self, channel):
+        if self.alert:
+            # Continuous conversions, ALERT/RDY pulses when one is ready
+            await self.start_continuous(channel)
+            await self.wait_ready()
+            result = await self.adc.registers.read(ADS1x15_POINTER_CONVERSION, 2)
+        else:
+            # Single shot conversion, then poll the OS bit
+            config = self.adc._config_value(channel + 0x04, self.gains[channel], self.data_rate, ADS1x15_CONFIG_MODE_SINGLE)
+            config |= ADS1x15_CONFIG_COMP_QUE_DISABLE
+            await self.adc._write_config(config, ADS1x15_CONFIG_MODE_SINGLE)
+            await asyncio.sleep(1.0 / self.data_rate)
+            while True:
+                # Status and result in one transfer
+                status, result = await self.bus.transfer(
+                    self.adc.address, [ADS1x15_POINTER_CONFIG], 2, [ADS1x15_POINTER_CONVERSION], 2)
+                if status[0] & (ADS1x15_CONFIG_OS_SINGLE >> 8):
+                    break
+                await asyncio.sleep(0.0005)
+        return self.adc._conversion_value(result[1], result[0])
+
+    async def capture(self, channel, buffer):
+        # Fill buffer with consecutive continuous conversions of channel, the
+        # scan of the other channels waits until the window is complete
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            await self.start_continuous(channel)
+            start = loop.time()
+            for index in range(len(buffer)):
+                if self.alert:
+                    await self.wait_ready()
+                else:
+                    await asyncio.sleep(start + (index + 1) / self.data_rate - loop.time())
+                result = await self.adc.registers.read(ADS1x15_POINTER_CONVERSION, 2)
+                buffer[index] = self.adc._conversion_value(result[1], result[0])
+
+    async def wait_conversion(self):
+        if self.alert:
+            await self.wait_ready()
+        else:
+            await asyncio.sleep(1.0 / self.data_rate)
+
+    async def wait_ready(self):
+        try:
+            await asyncio.wait_for(self.ready.wait(), 2.0 / self.data_rate + 0.01)
+        except asyncio.TimeoutError:
+            # Missed pulse: the conversion register holds the last result anyway
+            pass
+        self.ready.clear()
+
+    async def get_value(self, channel, timeout=1):
+        # Latest sample, waits for the first one
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while channel not in self.values:
+            if self.sample is None:
+                self.sample = loop.create_future()
+            await asyncio.wait_for(asyncio.shield(self.sample), end - loop.time())
+        return self.values[channel]
+
+    async def start_comparator(self, channel, high, low, callback):
+        self.validate_threshold(channel, 'high_threshold', high)
+        self.validate_threshold(channel, 'low_threshold', low)
+        factor = self.get_factor(channel)
+        self.comparator = (channel, round(high / factor), round(low / factor), callback)
+        self.comparator_above = False
+        await self.check_comparator()
+
+    async def stop_comparator(self):
+        self.comparator = None
+        if self.comparator_task:
+            self.comparator_task.cancel()
+            self.comparator_task = None
+        await self.adc.stop_adc()
+
+    async def read_comparator(self):
+        try:
+            while self.comparator_pending:
+                self.comparator_pending = False
+                await self.check_comparator()
+        except Exception as error:
+            self.log.exception('comparator', error)
+        finally:
+            self.comparator_task = None
+
+    async def check_comparator(self):
+        # Latching window comparator armed for the next crossing only: above
+        # high while below, below low while above. The chip stays silent
+        # until then, reading the result releases the latch.
+        channel, high, low, callback = self.comparator
+        async with self.lock:
+            while True:
+                if self.comparator_above:
+                    thresholds = (0x7FFF, low << self.threshold_shift)
+                else:
+                    thresholds = (high << self.threshold_shift, -0x8000)
+                value = await self.adc.start_adc_comparator(
+                    channel, *thresholds, gain=self.gains[channel], data_rate=self.data_rate,
+                    traditional=False, latching=True)
+                above = value >= low if self.comparator_above else value > high
+                if above == self.comparator_above:
+                    break
+                self.comparator_above = above
+        callback(self.comparator_above, value * self.get_factor(channel))
+
+    def get_factor(self, channel):
+        return ADS1x15_GAIN_VOLTAGE[self.gains[channel]] / self.max_value
+
+    def validate_threshold(self, channel, name, voltage):
+        # Out of range thresholds wrap around in the 16 bit register
+        factor = self.get_factor(channel)
+        if not -self.max_value <= round(float(voltage) / factor) <= self.max_value - 1:
+            full_scale = ADS1x15_GAIN_VOLTAGE[self.gains[channel]]
+            raise ValidationError('{} should be within +/-{} V at gain {}'.format(name, full_scale, self.gains[channel]))
+        return voltage
+
+    async def get_voltage(self, channel):
+        return await self.get_value(channel) * self.get_factor(channel)
+
+
+@register_hardware('ADS1115')
+class ADS1115Scanner(ADS1x15Scanner):
+    adc_class = ADS1115
+    max_value = 32768
+
+
+@register_hardware('ADS1015')
+class ADS1015Scanner(ADS1x15Scanner):
+    adc_class = ADS1015
+    max_value = 2048
+    # 12 bit thresholds are left justified like the conversion register
+    threshold_shift = 4
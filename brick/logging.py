@@ -2,8 +2,10 @@ import asyncio
 import io
 import sys
 import traceback
+from collections import OrderedDict, deque
 from logging import Handler
 from datetime import datetime
+from time import monotonic
 from uuid import uuid4
 
 
@@ -28,6 +30,7 @@ LEVEL_NAME = {
     INFO: 'info',
     DEBUG: 'debug',
 }
+EXCEPTION_KEYS = 10
 
 
 class Logger(Handler):
@@ -35,8 +38,13 @@ class Logger(Handler):
         super().__init__()
         self.log_collector = log_collector
         self.component = component
+        # Recent exceptions, the oldest is forgotten past EXCEPTION_KEYS
+        self.exceptions = OrderedDict()
+        self.exception_timer = None
 
     def emit(self, record):
+        if not self.is_enabled_for(record.levelno):
+            return
         try:
             self.log(record.levelno, self.format(record))
         except RecursionError:  # See issue 36272
@@ -44,6 +52,9 @@ class Logger(Handler):
         except Exception:
             self.handleError(record)
 
+    def is_enabled_for(self, level):
+        return level >= self.log_collector.get_threshold(self.component)
+
     def log(self, level, message, *args, **kwargs):
         self.log_collector.log(level, self.component, message, *args, **kwargs)
 
@@ -62,52 +73,188 @@ class Logger(Handler):
     def critical(self, message, *args, **kwargs):
         self.log(CRITICAL, message, *args)
 
-    def exception(self, message, error, *args, **kwargs):
+    def exception(self, message, error=None, *args, **kwargs):
+        if not self.is_enabled_for(ERROR):
+            return
+        if error is None:
+            error = sys.exc_info()[1]
+        key = (message, args, type(error), str(error))
+        now = monotonic()
+        interval = self.log_collector.exception_interval
+        entry = self.exceptions.get(key)
+        if entry:
+            # Same exception again: count it and only log a periodic summary
+            entry['count'] += 1
+            if now - entry['time'] >= interval:
+                self.log_repeated_exception(entry, now)
+            elif self.exception_timer is None:
+                # Summary of the last ones once the errors stop
+                self.exception_timer = self.log_collector.loop.call_later(interval, self.log_repeated_exceptions)
+            return
+        for entry in self.exceptions.values():
+            self.log_repeated_exception(entry, now)
+        self.exceptions[key] = dict(message=message % args if args else message, count=0, time=now)
+        if len(self.exceptions) > EXCEPTION_KEYS:
+            self.exceptions.popitem(last=False)
         stream = io.StringIO()
         traceback.print_exc(file=stream)
         self.log(ERROR, message, *args)
-        self.log(ERROR, stream.getvalue(), *args)
+        self.log(ERROR, stream.getvalue())
+
+    def log_repeated_exception(self, entry, now):
+        if entry['count']:
+            self.log(ERROR, '%s - repeated %d times', entry['message'], entry['count'])
+            entry['count'] = 0
+            entry['time'] = now
+
+    def log_repeated_exceptions(self):
+        self.exception_timer = None
+        now = monotonic()
+        interval = self.log_collector.exception_interval
+        delays = []
+        for entry in self.exceptions.values():
+            if entry['count'] and now - entry['time'] >= interval:
+                self.log_repeated_exception(entry, now)
+            elif entry['count']:
+                delays.append(interval - (now - entry['time']))
+        if delays:
+            self.exception_timer = self.log_collector.loop.call_later(min(delays), self.log_repeated_exceptions)
 
     def exc(self, error, message, *args, **kwargs):
         self.exception(message, error, *args, **kwargs)
 
 
 class LogCollector:
-    def __init__(self):
+    def __init__(self, buffer_size=1000, batch_size=100, exception_interval=60):
         self.consumers = dict()
+        self.thresholds = dict()
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.exception_interval = exception_interval
         self.loop = asyncio.get_event_loop()
 
+    def get_threshold(self, component):
+        threshold = self.thresholds.get(component)
+        if threshold is None:
+            threshold = NOTSET
+            for consumer in self.consumers.values():
+                threshold = min(threshold, consumer['components'].get(component, consumer['level']))
+            self.thresholds[component] = threshold
+        return threshold
+
     def log(self, level, component, message, *args, **kwargs):
-        timestamp = datetime.now()
+        if level < self.get_threshold(component):
+            return
+        if args:
+            message = message % args
+        record = (datetime.now(), level, component, message)
         for consumer in self.consumers.values():
             if level >= consumer['components'].get(component, consumer['level']):
-                self.loop.create_task(consumer['callback'](timestamp, level, component, message, *args, **kwargs))
+                records = consumer['records']
+                if len(records) == records.maxlen:
+                    consumer['dropped'] += 1
+                records.append(record)
+                if consumer['task'] is None:
+                    consumer['task'] = self.loop.create_task(self.drain(consumer))
+
+    async def drain(self, consumer):
+        records = consumer['records']
+        try:
+            while records:
+                batch = []
+                dropped = consumer['dropped'] - consumer['dropped_reported']
+                if dropped:
+                    consumer['dropped_reported'] = consumer['dropped']
+                    batch.append((datetime.now(), WARNING, 'log', '{} log records dropped'.format(dropped)))
+                while records and len(batch) < self.batch_size:
+                    batch.append(records.popleft())
+                if consumer['batch']:
+                    await consumer['callback'](batch)
+                else:
+                    for record in batch:
+                        await consumer['callback'](*record)
+                await asyncio.sleep(0)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+        finally:
+            consumer['task'] = None
 
     def get_logger(self, component):
         return Logger(self, component)
 
-    def add_consumer(self, callback, level='info', components=dict()):
+    def add_consumer(self, callback, level='info', components=dict(), batch=False):
         components = components or dict()
         consumer_id = uuid4()
         self.consumers[consumer_id] = dict(
             callback=callback,
             level=LEVEL_NUMBER.get(level, NOTSET),
-            components=dict([(x[0], LEVEL_NUMBER.get(x[1], NOTSET)) for x in components.items()])
+            components=dict([(x[0], LEVEL_NUMBER.get(x[1], NOTSET)) for x in components.items()]),
+            batch=batch,
+            records=deque(maxlen=self.buffer_size),
+            dropped=0,
+            dropped_reported=0,
+            task=None,
         )
+        self.thresholds = dict()
         return consumer_id
 
     def remove_consumer(self, consumer_id):
+        self.thresholds = dict()
         return self.consumers.pop(consumer_id, None)
 
 
+def format_record(record):
+    timestamp, level, component, message = record
+    return '{} {:8s} {}: {}\n'.format(timestamp.isoformat(), LEVEL_NAME[level].upper(), component, message)
+
+
 class StdoutLogConsumer:
     def __init__(self, log_collector, level='info', components=dict()):
-        log_collector.add_consumer(self.log, level=level, components=components)
-
-    async def log(self, timestamp, level, component, message, *args, **kwargs):
-        sys.stdout.write('{} {:8s} {}: {}\n'.format(
-            timestamp.isoformat(),
-            LEVEL_NAME[level].upper(),
-            component,
-            message,
-        ))
+        log_collector.add_consumer(self.log, level=level, components=components, batch=True)
+
+    async def log(self, records):
+        sys.stdout.write(''.join([format_record(record) for record in records]))
+
+
+class RingBufferLogConsumer:
+    def __init__(self, log_collector, size=1000, level='info', components=dict(), stream_size=100):
+        self.size = size
+        self.stream_size = stream_size
+        self.records = [None] * size
+        self.index = 0
+        self.count = 0
+        self.streams = set()
+        log_collector.add_consumer(self.log, level=level, components=components, batch=True)
+
+    async def log(self, records):
+        for record in records:
+            self.records[self.index] = record
+            self.index = (self.index + 1) % self.size
+        self.count = min(self.count + len(records), self.size)
+        for queue in self.streams:
+            for record in records:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(record)
+
+    def get_records(self, level='debug', component=None):
+        level = LEVEL_NUMBER.get(level, NOTSET)
+        start = self.index - self.count
+        records = []
+        for index in range(start, start + self.count):
+            record = self.records[index % self.size]
+            if record[1] >= level and (component is None or record[2] == component):
+                records.append(record)
+        return records
+
+    async def stream(self, level='debug', component=None):
+        level = LEVEL_NUMBER.get(level, NOTSET)
+        queue = asyncio.Queue(maxsize=self.stream_size)
+        self.streams.add(queue)
+        try:
+            while True:
+                record = await queue.get()
+                if record[1] >= level and (component is None or record[2] == component):
+                    yield record
+        finally:
+            self.streams.discard(queue)
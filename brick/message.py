@@ -1,4 +1,104 @@
 import asyncio
+import sys
+from collections import OrderedDict
+from itertools import count
+from brick.exceptions import ValidationError
+
+
+EAGER_START = sys.version_info >= (3, 12)
+MAILBOX_POLICIES = ['drop_oldest', 'latest']
+MAILBOX_DEFAULT_POLICY = 'drop_oldest'
+
+
+def fast_callback(callback):
+    # Mark a callback that completes without waiting on I/O: in inline mode
+    # the dispatcher awaits it directly instead of wrapping it into a task.
+    callback.fast_callback = True
+    return callback
+
+
+def create_eager_task(coro):
+    # Run the coroutine on the caller's stack up to its first suspension point.
+    return asyncio.Task(coro, loop=asyncio.get_running_loop(), eager_start=True)
+
+
+def get_pattern_levels(sender, topic):
+    levels = ['+' if sender is None else sender]
+    if topic is not None:
+        levels.extend(topic.split('/'))
+    elif sender != '#':
+        levels.append('#')
+    return levels
+
+
+def is_valid_pattern(levels):
+    for index, level in enumerate(levels):
+        if level == '#':
+            if index != len(levels) - 1:
+                return False
+        elif level != '+' and ('#' in level or '+' in level):
+            return False
+    return True
+
+
+def match_levels(pattern, levels):
+    for index, level in enumerate(pattern):
+        if level == '#':
+            return True
+        if index >= len(levels):
+            return False
+        if level != '+' and level != levels[index]:
+            return False
+    return len(pattern) == len(levels)
+
+
+class TopicNode:
+    def __init__(self):
+        self.children = dict()
+        self.keys = []
+
+
+class TopicTrie:
+    def __init__(self):
+        self.root = TopicNode()
+
+    def add(self, levels, key):
+        node = self.root
+        for level in levels:
+            node = node.children.setdefault(level, TopicNode())
+        if key not in node.keys:
+            node.keys.append(key)
+
+    def remove(self, levels, key):
+        path = [self.root]
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if key in path[-1].keys:
+            path[-1].keys.remove(key)
+        for level, parent, node in reversed(list(zip(levels, path, path[1:]))):
+            if node.keys or node.children:
+                break
+            del parent.children[level]
+
+    def match(self, levels):
+        keys = []
+        self._match(self.root, levels, 0, keys)
+        return keys
+
+    def _match(self, node, levels, index, keys):
+        if index == len(levels):
+            keys.extend(node.keys)
+        else:
+            for level in (levels[index], '+'):
+                child = node.children.get(level)
+                if child is not None:
+                    self._match(child, levels, index + 1, keys)
+        child = node.children.get('#')
+        if child is not None:
+            keys.extend(child.keys)
 
 
 class Broker:
@@ -19,57 +119,207 @@ class Broker:
         return self.dispatcher.publish(self.component, topic=topic, payload=payload)
 
 
+class Mailbox:
+    def __init__(self, dispatcher, component, size=100, policy=MAILBOX_DEFAULT_POLICY):
+        self.dispatcher = dispatcher
+        self.component = component
+        self.size = int(size)
+        self.policy = self.validate_policy(policy)
+        self.messages = OrderedDict()
+        self.counter = count()
+        self.dropped = 0
+        self.max_depth = 0
+        self.full = False
+        self.task = None
+
+    @staticmethod
+    def validate_policy(policy):
+        if policy not in MAILBOX_POLICIES:
+            raise ValidationError('Mailbox policy should be one of {}'.format(MAILBOX_POLICIES))
+        return policy
+
+    def put(self, log_context, callback, sender, topic, payload):
+        waiter = asyncio.get_running_loop().create_future()
+        message = (log_context, callback, sender, topic, payload, waiter)
+        if self.policy == 'latest':
+            key = (callback, sender, topic)
+            if key in self.messages:
+                self._done(self.messages[key])
+                self.messages[key] = message
+                return waiter
+        else:
+            key = next(self.counter)
+        if len(self.messages) >= self.size:
+            if self.policy == 'drop_oldest':
+                self._done(self.messages.popitem(last=False)[1])
+                self.dropped += 1
+            # latest keeps one message per key: it is bounded by the number
+            # of topics, size only warns
+            self.messages[key] = message
+            if not self.full:
+                self.full = True
+                self.dispatcher.log.warning('Mailbox full - {} ({} queued, {} dropped)'.format(
+                    self.component, len(self.messages), self.dropped))
+        else:
+            self.messages[key] = message
+        self.max_depth = max(self.max_depth, len(self.messages))
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return waiter
+
+    async def run(self):
+        try:
+            while self.messages:
+                message = self.messages.popitem(last=False)[1]
+                if self.full and len(self.messages) < self.size // 2:
+                    self.full = False
+                    self.dispatcher.log.info('Mailbox drained - {} ({} dropped)'.format(self.component, self.dropped))
+                log_context, callback, sender, topic, payload, waiter = message
+                await self.dispatcher._callback_wrapper(log_context, callback, sender=sender, topic=topic, payload=payload)
+                self._done(message)
+        finally:
+            self.task = None
+
+    def _done(self, message):
+        waiter = message[5]
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def get_stats(self):
+        return dict(
+            size=self.size,
+            policy=self.policy,
+            depth=len(self.messages),
+            max_depth=self.max_depth,
+            dropped=self.dropped,
+        )
+
+
 class Dispatcher:
-    def __init__(self, log):
+    def __init__(self, log, inline=False, mailbox=None):
         self.log = log
+        self.inline = inline
+        self.create_task = asyncio.create_task
+        if inline and EAGER_START:
+            self.create_task = create_eager_task
         self.callbacks = dict()
         self.subscriptions = dict()
+        self.topic_trie = TopicTrie()
+        self.routes = dict()
+        # Mailboxes
+        self.mailbox_config = None
+        self.mailboxes = dict()
+        if mailbox is not None:
+            mailbox = dict(mailbox)
+            self.mailbox_components = mailbox.pop('components', None) or dict()
+            self.mailbox_config = mailbox
+            for config in [mailbox] + list(self.mailbox_components.values()):
+                Mailbox.validate_policy(config.get('policy', MAILBOX_DEFAULT_POLICY))
 
     def get_broker(self, component, callback=None):
         self.callbacks[component] = callback
+        if self.mailbox_config is not None:
+            self.get_mailbox(component)
         return Broker(self, component)
 
+    def get_mailbox(self, component):
+        if component not in self.mailboxes:
+            config = dict(self.mailbox_config)
+            config.update(self.mailbox_components.get(component, dict()))
+            self.mailboxes[component] = Mailbox(self, component, **config)
+        return self.mailboxes[component]
+
+    def get_mailbox_stats(self):
+        return dict([(c, m.get_stats()) for c, m in self.mailboxes.items()])
+
     def send(self, sender, recipient, topic, payload=None):
-        self.log.debug('send - {} -> {}/{} {}'.format(sender, recipient, topic, payload))
+        self.log.debug('send - %s -> %s/%s %s', sender, recipient, topic, payload)
         if recipient in self.callbacks:
             callback = self.callbacks[recipient]
             if bool(callback):
                 log_context = ' - {} -> {}'.format(sender, recipient)
+                if self.inline:
+                    fast = getattr(callback, 'fast_callback', False)
+                    mailbox = self.get_mailbox(recipient) if self.mailbox_config is not None else None
+                    route = ((log_context, callback, fast, mailbox),)
+                    return self.create_task(self._deliver(route, sender, topic, payload))
+                if self.mailbox_config is not None:
+                    return self.get_mailbox(recipient).put(log_context, callback, sender, topic, payload)
                 coro = self._callback_wrapper(log_context, callback, sender=sender, topic=topic, payload=payload)
-                return asyncio.create_task(coro)
+                return self.create_task(coro)
             else:
                 self.log.error('No callback - {} -> {}'.format(sender, recipient))
         else:
             self.log.error('No recipient - {} -> {}'.format(sender, recipient))
 
     def subscribe(self, component, callback, sender, topic):
-        self.log.debug('subscribe - {} - {}/{}'.format(component, sender, topic))
+        self.log.debug('subscribe - %s - %s/%s', component, sender, topic)
+        levels = get_pattern_levels(sender, topic)
+        if not is_valid_pattern(levels):
+            self.log.error('Invalid pattern - {} -> {}/{}'.format(component, sender, topic))
+            return
         components = self.subscriptions.setdefault((sender, topic), dict())
         if component in components:
             self.log.error('Already subscribed - {} -> {}/{}'.format(component, sender, topic))
         components[component] = callback
+        self.topic_trie.add(levels, (sender, topic))
+        self._drop_routes(levels)
 
     def unsubscribe(self, component, sender, topic):
-        self.log.debug('unsubscribe - {} - {}/{}'.format(component, sender, topic))
+        self.log.debug('unsubscribe - %s - %s/%s', component, sender, topic)
         key = (sender, topic)
+        levels = get_pattern_levels(sender, topic)
         components = self.subscriptions.get(key, dict())
-        components.pop(component, None)
+        if components.pop(component, None):
+            self._drop_routes(levels)
         if not components:
             self.subscriptions.pop(key, None)
+            self.topic_trie.remove(levels, key)
 
     def publish(self, sender, topic, payload=None):
-        self.log.debug('publish - {}/{} {}'.format(sender, topic, payload))
-        recipients = []
-        for key in [(sender, topic), (sender, None), (None, topic), (None, None)]:
-            for component, callback in self.subscriptions.get(key, dict()).items():
-                recipients.append((component, callback))
-        tasks = []
-        for component, callback in recipients:
-            log_context = ' - {} <- {}/{}'.format(component, sender, topic)
-            tasks.append(asyncio.create_task(self._callback_wrapper(log_context, callback, sender=sender, topic=topic, payload=payload)))
-        return asyncio.create_task(self._gather(tasks))
-
-    async def _gather(self, tasks):
+        self.log.debug('publish - %s/%s %s', sender, topic, payload)
+        route = self.routes.get((sender, topic))
+        if route is None:
+            route = self._compile_route(sender, topic)
+        if self.inline:
+            return self.create_task(self._deliver(route, sender, topic, payload))
+        if self.mailbox_config is not None:
+            return asyncio.gather(*[
+                mailbox.put(log_context, callback, sender, topic, payload)
+                for log_context, callback, fast, mailbox in route
+            ])
+        return asyncio.gather(*[
+            asyncio.create_task(self._callback_wrapper(log_context, callback, sender=sender, topic=topic, payload=payload))
+            for log_context, callback, fast, mailbox in route
+        ])
+
+    def _compile_route(self, sender, topic):
+        route = []
+        for key in self.topic_trie.match(get_pattern_levels(sender, topic)):
+            for component, callback in self.subscriptions[key].items():
+                log_context = ' - {} <- {}/{}'.format(component, sender, topic)
+                fast = getattr(callback, 'fast_callback', False)
+                mailbox = self.get_mailbox(component) if self.mailbox_config is not None else None
+                route.append((log_context, callback, fast, mailbox))
+        route = tuple(route)
+        self.routes[(sender, topic)] = route
+        return route
+
+    def _drop_routes(self, pattern):
+        for key in list(self.routes.keys()):
+            if match_levels(pattern, get_pattern_levels(*key)):
+                del self.routes[key]
+
+    async def _deliver(self, route, sender, topic, payload):
+        # fast callbacks skip the mailbox of their component
+        tasks = [
+            mailbox.put(log_context, callback, sender, topic, payload) if mailbox else
+            self.create_task(self._callback_wrapper(log_context, callback, sender=sender, topic=topic, payload=payload))
+            for log_context, callback, fast, mailbox in route if not fast
+        ]
+        for log_context, callback, fast, mailbox in route:
+            if fast:
+                await self._callback_wrapper(log_context, callback, sender=sender, topic=topic, payload=payload)
         for task in tasks:
             await task
 
@@ -1,6 +1,19 @@
 import asyncio
-import re
+import json
+import os
+import sys
+from collections import OrderedDict
+from itertools import count
+import aiofiles
 from hbmqtt import client
+from brick import validators
+from brick.exceptions import ValidationError
+from brick.message import fast_callback, get_pattern_levels, is_valid_pattern, match_levels
+
+
+qos_validator = validators.IntegerValidator(name='qos', min_value=0, max_value=2)
+retain_validator = validators.BooleanValidator(name='retain')
+SNAPSHOT_MODES = ['device', 'brick']
 
 
 class MQTTClient(client.MQTTClient):
@@ -9,14 +22,83 @@ class MQTTClient(client.MQTTClient):
         self.on_connect = on_connect
         super().__init__(*args, **kwargs)
 
+    @property
+    def is_connected(self):
+        return self._connected_state.is_set()
+
     async def _do_connect(self):
         await super()._do_connect()
         if self.on_connect:
             await self.on_connect()
 
 
+class Spool:
+    def __init__(self, file_name, max_size=1048576):
+        self.file_name = file_name
+        self.max_size = max_size
+        self.size = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+        self.lock = asyncio.Lock()
+
+    def encode(self, messages):
+        return ''.join([json.dumps([topic, payload.decode(), qos, retain]) + '\n' for topic, payload, qos, retain in messages])
+
+    def compact(self, messages):
+        # Retained topics only need their latest value
+        latest = dict()
+        for index, (topic, payload, qos, retain) in enumerate(messages):
+            if retain:
+                latest[topic] = index
+        return [m for index, m in enumerate(messages) if not m[3] or latest[m[0]] == index]
+
+    async def read(self):
+        if not self.size:
+            return []
+        async with aiofiles.open(self.file_name, mode='r') as f:
+            text = await f.read()
+        messages = []
+        for line in text.splitlines():
+            try:
+                topic, payload, qos, retain = json.loads(line)
+            except ValueError:
+                continue
+            messages.append((topic, payload.encode(), qos, retain))
+        return messages
+
+    async def write(self, messages):
+        text = self.encode(messages)
+        async with aiofiles.open(self.file_name + '.tmp', mode='w') as f:
+            await f.write(text)
+        os.replace(self.file_name + '.tmp', self.file_name)
+        self.size = len(text)
+
+    async def append(self, messages):
+        async with self.lock:
+            text = self.encode(messages)
+            async with aiofiles.open(self.file_name, mode='a') as f:
+                await f.write(text)
+            self.size += len(text)
+            if self.size > self.max_size:
+                messages = self.compact(await self.read())
+                # Drop the oldest messages until half of the spool is free
+                while messages and len(self.encode(messages)) > self.max_size // 2:
+                    messages = messages[len(messages) // 10 + 1:]
+                await self.write(messages)
+
+    async def restore(self, messages):
+        async with self.lock:
+            await self.write(self.compact(messages + await self.read()))
+
+    async def pop(self):
+        async with self.lock:
+            messages = self.compact(await self.read())
+            if self.size:
+                os.remove(self.file_name)
+                self.size = 0
+            return messages
+
+
 class Mqtt:
-    def __init__(self, log, broker, name='brick', config=dict()):
+    def __init__(self, log, broker, name='brick', config=dict(), config_dir=None):
         self.log = log
         self.broker = broker
         self.name = name
@@ -25,11 +107,42 @@ class Mqtt:
         self.last_will_topic = '{}/brick/get/state'.format(self.prefix)
         self.host = config.get('host', 'localhost')
         self.port = config.get('port', 1883)
-        self.message_re = re.compile('^{}/(\w+)/set/(.+)$'.format(self.prefix))
+        self.message_prefix = '{}/'.format(self.prefix)
         self.excluded_components = ['network']
-        self.available_components = [x for x in self.broker.dispatcher.callbacks.keys() if not x in self.excluded_components]
+        self.available_components = frozenset([x for x in self.broker.dispatcher.callbacks.keys() if not x in self.excluded_components])
+        # Qos and retain policy
+        self.qos = qos_validator(config.get('qos', 1))
+        self.retain = retain_validator(config.get('retain', True))
+        self.subscribe_qos = qos_validator(config.get('subscribe_qos', 2))
+        self.policy = self.validate_policy(config.get('policy', []))
+        # Snapshot mode
+        self.snapshot = self.validate_snapshot(config.get('snapshot', None))
+        self.snapshot_topic = config.get('snapshot_topic', 'snapshot')
+        self.snapshot_individual = validators.BooleanValidator(name='snapshot_individual')(config.get('snapshot_individual', False))
+        self.snapshots = dict()
+        self.routes = dict()
+        self.payload_cache = dict()
+        self.payload_cache_size = 256
         self.client = self.get_client()
         self.connect_parameters = self.get_connect_parameters()
+        # Outbound queue
+        self.max_inflight = config.get('max_inflight', 10)
+        self.queue_size = config.get('queue_size', 1000)
+        self.outbound = OrderedDict()
+        self.outbound_counter = count()
+        self.outbound_event = asyncio.Event()
+        self.outbound_full = False
+        self.dropped = 0
+        self.publisher_tasks = []
+        self.read_task = None
+        # Store and forward spool
+        self.spool = None
+        self.spool_rate = config.get('spool_rate', 20)
+        self.replay_task = None
+        self.fresh_topics = set()
+        spool_size = config.get('spool_size', 1048576)
+        if config_dir is not None and spool_size:
+            self.spool = Spool(os.path.join(config_dir, 'mqtt_spool.jsonl'), max_size=spool_size)
 
     def get_client(self):
         return MQTTClient(
@@ -42,7 +155,7 @@ class Mqtt:
         return dict(
             keep_alive=self.config.get('keep_alive', 5),
             ping_delay=1,
-            default_qos=2,
+            default_qos=self.qos,
             default_retain=False,
             auto_reconnect=True,
             reconnect_max_interval=5,
@@ -55,6 +168,50 @@ class Mqtt:
             )
         )
 
+    def validate_policy(self, policy):
+        rules = []
+        for rule in policy:
+            rule = dict(rule)
+            pattern = get_pattern_levels(rule.pop('device', None), rule.pop('topic', None))
+            if not is_valid_pattern(pattern):
+                raise ValidationError("Invalid policy pattern '{}'".format('/'.join(pattern)))
+            qos = qos_validator(rule.pop('qos', self.qos))
+            retain = retain_validator(rule.pop('retain', self.retain))
+            if rule:
+                raise ValidationError('Unknown policy parameters: {}'.format(', '.join(rule.keys())))
+            rules.append((pattern, qos, retain))
+        return rules
+
+    def validate_snapshot(self, snapshot):
+        if snapshot is not None and snapshot not in SNAPSHOT_MODES:
+            raise ValidationError('Snapshot mode should be one of {}'.format(SNAPSHOT_MODES))
+        return snapshot
+
+    def get_policy(self, sender, topic):
+        levels = get_pattern_levels(sender, topic)
+        for pattern, qos, retain in self.policy:
+            if match_levels(pattern, levels):
+                return (qos, retain)
+        return (self.qos, self.retain)
+
+    def get_route(self, sender, topic):
+        route = self.routes.get((sender, topic))
+        if route is None:
+            mqtt_topic = sys.intern('{}/{}/get/{}'.format(self.prefix, sender, topic))
+            route = (mqtt_topic,) + self.get_policy(sender, topic)
+            self.routes[(sender, topic)] = route
+        return route
+
+    def encode_payload(self, payload):
+        if type(payload) is not str:
+            return str(payload).encode()
+        data = self.payload_cache.get(payload)
+        if data is None:
+            if len(self.payload_cache) >= self.payload_cache_size:
+                self.payload_cache.clear()
+            data = self.payload_cache[payload] = payload.encode()
+        return data
+
     def get_connect_parameters(self):
         auth = ''
         username = self.config.get('username', None)
@@ -68,28 +225,43 @@ class Mqtt:
 
     async def start(self, **kwargs):
         self.log.info('Started. Server: {}'.format(self.host))
+        self.publisher_tasks = [asyncio.create_task(self.publisher()) for _ in range(self.max_inflight)]
+        for component in self.available_components:
+            self.broker.subscribe(self.on_event_published, sender=component)
         asyncio.create_task(self.connect())
 
     async def stop(self, **kwargs):
-        self.broker.unsubscribe()
+        for component in self.available_components:
+            self.broker.unsubscribe(sender=component)
+        for task in self.publisher_tasks:
+            task.cancel()
+        self.publisher_tasks = []
+        if self.read_task:
+            self.read_task.cancel()
+            self.read_task = None
         await self.client.disconnect()
         self.log.info('Stopped')
 
     async def connect(self):
         await self.client.connect(**self.connect_parameters)
-        asyncio.create_task(self.read_messages())
-        self.broker.subscribe(self.on_event_published)
+        self.read_task = asyncio.create_task(self.read_messages())
         asyncio.create_task(self.publish_state())
 
     async def on_connect(self):
         await self.client.publish(self.last_will_topic, b'online')
         topic = '{}/+/set/#'.format(self.prefix)
-        await self.client.subscribe([(topic, 2)])
+        await self.client.subscribe([(topic, self.subscribe_qos)])
         self.log.info('Connected')
+        self.fresh_topics = set()
+        if self.spool and self.spool.size and self.replay_task is None:
+            self.replay_task = asyncio.create_task(self.replay())
 
-    async def publish_state(self):
-        await asyncio.sleep(1)
-        await self.broker.publish(topic='publish_state')
+    async def publish_state(self, delay=1):
+        await asyncio.sleep(delay)
+        if self.snapshot:
+            await self.broker.publish(topic='publish_snapshot')
+        if self.snapshot_individual or not self.snapshot:
+            await self.broker.publish(topic='publish_state')
 
     def _on_message(self, topic, payload, retained):
         asyncio.create_task(self.on_message(topic, payload, retained))
@@ -106,19 +278,94 @@ class Mqtt:
                 self.log.exception('read_messages', error)
 
     async def on_message(self, topic, payload):
-        self.log.debug('message received: {} {}'.format(topic, payload))
+        self.log.debug('message received: %s %s', topic, payload)
         try:
-            match = self.message_re.match(topic)
-            if match:
-                recipient = match.group(1)
-                topic = match.group(2)
-                if recipient in self.available_components:
+            if topic.startswith(self.message_prefix):
+                recipient, _, topic = topic[len(self.message_prefix):].partition('/')
+                action, _, topic = topic.partition('/')
+                if action == 'set' and topic and recipient in self.available_components:
                     self.broker.send(recipient, topic, payload)
         except Exception as error:
             self.log.exception('on_message')
 
+    @fast_callback
     async def on_event_published(self, sender, topic, payload=None):
         if sender in self.available_components:
-            self.log.debug('event published: {}/{} {}'.format(sender, topic, payload))
-            topic = '{}/{}/get/{}'.format(self.prefix, sender, topic)
-            await self.client.publish(topic, str(payload).encode(), True, 1)
+            self.log.debug('event published: %s/%s %s', sender, topic, payload)
+            if topic == 'snapshot' and self.snapshot:
+                self.on_snapshot(sender, payload)
+                return
+            topic, qos, retain = self.get_route(sender, topic)
+            self.enqueue(topic, self.encode_payload(payload), qos, retain)
+
+    def on_snapshot(self, sender, payload):
+        if self.snapshot == 'device':
+            topic, qos, retain = self.get_route(sender, self.snapshot_topic)
+            self.enqueue(topic, payload.encode(), qos, retain)
+        else:
+            # The brick document is built when sent: device snapshots
+            # arriving meanwhile are merged into a single publish
+            self.snapshots[sender] = payload
+            topic, qos, retain = self.get_route('brick', self.snapshot_topic)
+            self.enqueue(topic, self.get_brick_snapshot, qos, retain)
+
+    def get_brick_snapshot(self):
+        items = ['"{}":{}'.format(name, snapshot) for name, snapshot in sorted(self.snapshots.items())]
+        return '{{{}}}'.format(','.join(items)).encode()
+
+    def enqueue(self, topic, payload, qos, retain):
+        # Retained topics only need their latest value: replace it in place
+        key = topic if retain else next(self.outbound_counter)
+        if key not in self.outbound and len(self.outbound) >= self.queue_size:
+            self.outbound.popitem(last=False)
+            self.dropped += 1
+            if not self.outbound_full:
+                self.outbound_full = True
+                self.log.warning('Outbound queue full ({} dropped)'.format(self.dropped))
+        self.outbound[key] = (topic, payload, qos, retain)
+        self.outbound_event.set()
+
+    async def publisher(self):
+        while True:
+            while not self.outbound:
+                self.outbound_full = False
+                self.outbound_event.clear()
+                await self.outbound_event.wait()
+            topic, payload, qos, retain = self.outbound.popitem(last=False)[1]
+            if callable(payload):
+                payload = payload()
+            message = (topic, payload, qos, retain)
+            try:
+                if self.spool and not self.client.is_connected:
+                    await self.spool.append([message])
+                    continue
+                await self.client.publish(topic, payload, qos=qos, retain=retain)
+                if retain:
+                    self.fresh_topics.add(topic)
+            except Exception as error:
+                self.log.exception('publish', error)
+                if self.spool:
+                    await self.spool.append([message])
+
+    async def replay(self):
+        try:
+            messages = await self.spool.pop()
+            self.log.info('Replaying {} spooled messages'.format(len(messages)))
+            for index, message in enumerate(messages):
+                topic, payload, qos, retain = message
+                # Skip values already superseded by live traffic
+                if retain and (topic in self.fresh_topics or topic in self.outbound):
+                    continue
+                if not self.client.is_connected:
+                    await self.spool.restore(messages[index:])
+                    return
+                try:
+                    await self.client.publish(topic, payload, qos=qos, retain=retain)
+                except Exception as error:
+                    self.log.exception('replay', error)
+                    await self.spool.restore(messages[index:])
+                    return
+                if (index + 1) % self.spool_rate == 0:
+                    await asyncio.sleep(1)
+        finally:
+            self.replay_task = None
@@ -13,22 +13,29 @@ from . import root
 
 
 class App(FastAPI):
-    def __init__(self, config_manager):
+    def __init__(self, config_manager, dispatcher=None, log_buffer=None):
         module_path = os.path.dirname(os.path.realpath(__file__))
         super().__init__(routes=[
             APIRoute('/', root.home),
             APIRoute('/config', root.config, methods=['GET', 'POST']),
+            APIRoute('/mailboxes/', root.mailboxes),
+            APIRoute('/i2c/', root.i2c),
+            APIRoute('/log/{level}/', root.log),
+            APIRoute('/log/{level}/stream/', root.log_stream),
             Mount('/static', StaticFiles(directory=os.path.join(module_path, 'static')), name='static'),
         ])
         self.templates = Jinja2Templates(directory=os.path.join(module_path, 'templates'))
         self.config_manager = config_manager
+        self.dispatcher = dispatcher
+        self.log_buffer = log_buffer
 
 
 class Server:
-    def __init__(self, log_collector, broker, config_manager, config=dict()):
+    def __init__(self, log_collector, broker, config_manager, log_buffer=None, config=dict()):
         self.log_collector = log_collector
         self.broker = broker
         self.config_manager = config_manager
+        self.log_buffer = log_buffer
         self.config = config
         self.log = self.log_collector.get_logger('web')
         self.host = config.get('host', '0.0.0.0')
@@ -39,7 +46,11 @@ class Server:
         self.hypercorn_config = Config()
         self.hypercorn_config.bind = ['{}:{}'.format(self.host, self.port)]
         self.hypercorn_config.logconfig_dict = self.get_log_config()
-        self.app = App(config_manager=self.config_manager)
+        self.app = App(
+            config_manager=self.config_manager,
+            dispatcher=self.broker.dispatcher,
+            log_buffer=self.log_buffer,
+        )
 
     def shutdown_signal_handler(self, *args) -> None:
             self.shutdown_event.set()
@@ -1,7 +1,9 @@
 import os
-from fastapi import Request
-from starlette.responses import RedirectResponse
+from fastapi import HTTPException, Request
+from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from brick.exceptions import ValidationError
+from brick.hardware.i2c import i2c_manager
+from brick.logging import LEVEL_NUMBER, format_record
 
 
 async def home(request: Request):
@@ -29,3 +31,35 @@ async def config(request: Request):
 
     context = dict(request=request, errors=errors, config_text=config_text)
     return request.app.templates.TemplateResponse('config.html', context)
+
+
+async def mailboxes(request: Request):
+    return JSONResponse(request.app.dispatcher.get_mailbox_stats())
+
+
+async def i2c(request: Request):
+    return JSONResponse(i2c_manager.get_stats())
+
+
+def get_log_buffer(request, level):
+    if level not in LEVEL_NUMBER:
+        raise HTTPException(status_code=404, detail="Level '{}' does not exist.".format(level))
+    if not request.app.log_buffer:
+        raise HTTPException(status_code=404, detail='Log buffer not available.')
+    return request.app.log_buffer
+
+
+async def log(request: Request, level: str, component: str = None):
+    log_buffer = get_log_buffer(request, level)
+    records = log_buffer.get_records(level=level, component=component)
+    return PlainTextResponse(''.join([format_record(record) for record in records]))
+
+
+async def log_stream(request: Request, level: str, component: str = None):
+    log_buffer = get_log_buffer(request, level)
+
+    async def events():
+        async for record in log_buffer.stream(level=level, component=component):
+            yield 'data: {}\n\n'.format(format_record(record).rstrip('\n').replace('\n', '\ndata: '))
+
+    return StreamingResponse(events(), media_type='text/event-stream')
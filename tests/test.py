@@ -24,21 +24,58 @@ class Logger:
         self.level = level
         self.logged = []
 
-    def append(self, msg, type):
+    def append(self, msg, type, *args):
         if self.level_order[type] >= self.level_order[self.level]:
+            if args:
+                msg = msg % args
             self.logged.append((type, msg))
 
-    def debug(self, msg):
-        self.append(msg, 'debug')
+    def debug(self, msg, *args):
+        self.append(msg, 'debug', *args)
 
-    def info(self, msg):
-        self.append(msg, 'info')
+    def info(self, msg, *args):
+        self.append(msg, 'info', *args)
 
-    def warning(self, msg):
-        self.append(msg, 'warning')
+    def warning(self, msg, *args):
+        self.append(msg, 'warning', *args)
 
-    def error(self, msg):
-        self.append(msg, 'error')
+    def error(self, msg, *args):
+        self.append(msg, 'error', *args)
 
-    def exception(self, msg, error):
-        self.append(msg, 'exception')
+    def exception(self, msg, error, *args):
+        self.append(msg, 'exception', *args)
+
+
+class Chip:
+    # I2C register chip: a write sets the register pointer, kept between
+    # transfers, and a read starts from it.
+    def __init__(self, registers=None):
+        self.registers = dict(registers or ())
+        self.transfers = []
+        self.reads = []
+        self.writes = []
+        self.pointer = 0
+
+    async def transfer(self, address, *messages):
+        self.transfers.append(messages)
+        data = []
+        for message in messages:
+            if isinstance(message, int):
+                self.reads.append(self.pointer)
+                data.append([self.registers.get(self.pointer + index, 0) for index in range(message)])
+            else:
+                self.pointer = message[0]
+                for index, value in enumerate(message[1:]):
+                    self.writes.append((self.pointer + index, value))
+                    self.registers[self.pointer + index] = value
+        return data
+
+
+class ErrorChip(Chip):
+    async def transfer(self, address, *messages):
+        raise OSError('Remote I/O error')
+
+
+class HardwareManager:
+    def __init__(self, **hardware):
+        self.hardware = hardware
@@ -0,0 +1,275 @@
+import asyncio
+import math
+import unittest
+from array import array
+from decimal import Decimal
+from gpiozero import Device as GPIODevice
+from gpiozero.pins.mock import MockFactory
+from .test import Callback, HardwareManager, Logger
+from brick.device.adc import ADS1115, get_waveform_stats
+from brick.exceptions import ValidationError
+from brick.message import Dispatcher
+from brick.hardware.ti.ads1x15 import ADS1115Scanner, ADS1x15Input
+
+
+class Bus:
+    def __init__(self):
+        # Conversion result of each single ended mux
+        self.inputs = dict([(mux, 1000 * (mux - 3)) for mux in range(4, 8)])
+        self.config = 0x8583
+        self.thresholds = dict()
+        self.transfers = []
+        self.configs = []
+        self.waveform = None
+        self.index = 0
+        self.pointer = 0
+
+    async def transfer(self, address, *messages):
+        self.transfers.append(messages)
+        data = []
+        for message in messages:
+            if isinstance(message, int):
+                if self.pointer == 0x01:
+                    data.append([self.config >> 8 | 0x80, self.config & 0xff])
+                elif self.pointer == 0x00 and self.waveform:
+                    value = self.waveform[self.index % len(self.waveform)] & 0xffff
+                    self.index += 1
+                    data.append([value >> 8, value & 0xff])
+                elif self.pointer == 0x00:
+                    value = self.inputs.get(self.config >> 12 & 0x07, 0) & 0xffff
+                    data.append([value >> 8, value & 0xff])
+                else:
+                    data.append([0, 0])
+            else:
+                self.pointer = message[0]
+                if self.pointer == 0x01 and len(message) == 3:
+                    self.config = message[1] << 8 | message[2]
+                    self.configs.append(self.config)
+                elif len(message) == 3:
+                    value = message[1] << 8 | message[2]
+                    self.thresholds[self.pointer] = value - 0x10000 if value & 0x8000 else value
+        return data
+
+
+class ADS1x15ScannerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.chip = ADS1115Scanner(data_rate=860, interval=0)
+        self.chip.log = Logger()
+        self.chip.bus = self.chip.adc.registers.bus = Bus()
+        self.inputs = [ADS1x15Input(device=self.chip, channel=channel) for channel in (0, 1, 3)]
+        await self.chip.setup()
+
+    async def asyncTearDown(self):
+        for channel in self.inputs:
+            await channel.teardown()
+
+    def test_channel_config(self):
+        with self.assertRaises(ValidationError):
+            ADS1x15Input(device=self.chip, channel=1)
+        with self.assertRaises(ValidationError):
+            ADS1x15Input(device=self.chip, channel=2, gain=3)
+        with self.assertRaises(ValidationError):
+            ADS1115Scanner(data_rate=100)
+
+    async def test_scan(self):
+        for channel in self.inputs:
+            await channel.setup()
+        voltages = [await channel.get_voltage() for channel in self.inputs]
+        self.assertEqual(voltages, [1000 * 4.096 / 32768, 2000 * 4.096 / 32768, 4000 * 4.096 / 32768])
+        await asyncio.sleep(0.02)
+        # Channels are converted in order, one after the other
+        muxes = [config >> 12 & 0x07 for config in self.chip.bus.configs]
+        self.assertEqual(muxes[:6], [4, 5, 7, 4, 5, 7])
+
+    async def test_interval(self):
+        chip = ADS1115Scanner(data_rate=860)
+        self.assertEqual(chip.get_interval(), 1)
+        delay = [10]
+        chip.attached = {0: lambda: delay[0], 1: 30, 2: None}
+        self.assertEqual(chip.get_interval(), 10)
+        delay[0] = 60
+        self.assertEqual(chip.get_interval(), 30)
+        self.assertEqual(self.chip.get_interval(), 0)
+
+    async def test_paced(self):
+        # Without an explicit interval one scan per reading of the consumer
+        self.chip.interval = None
+        await self.inputs[0].setup(interval=0.05)
+        await self.inputs[0].get_voltage()
+        await asyncio.sleep(0.02)
+        self.assertEqual(len(self.chip.bus.configs), 1)
+
+    async def test_detach(self):
+        await self.inputs[0].setup()
+        await self.inputs[0].get_voltage()
+        await self.inputs[0].teardown()
+        self.assertIsNone(self.chip.task)
+        self.assertEqual(self.chip.values, dict())
+
+
+class ADS1x15ScannerAlertTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        GPIODevice.pin_factory = MockFactory()
+        self.pin = GPIODevice.pin_factory.pin(5)
+        self.chip = ADS1115Scanner(data_rate=860, alert_pin=5, interval=0)
+        self.chip.log = Logger()
+        self.chip.bus = self.chip.adc.registers.bus = Bus()
+        self.input = ADS1x15Input(device=self.chip, channel=2)
+        await self.chip.setup()
+        self.pulse_task = asyncio.create_task(self.pulse())
+
+    async def asyncTearDown(self):
+        self.pulse_task.cancel()
+        await self.input.teardown()
+        self.chip.alert.close()
+        GPIODevice.pin_factory.reset()
+
+    async def pulse(self):
+        while True:
+            await asyncio.sleep(0.002)
+            self.pin.drive_low()
+            self.pin.drive_high()
+
+    async def test_continuous(self):
+        await self.input.setup()
+        self.assertEqual(await self.input.get_voltage(), 3000 * 4.096 / 32768)
+        await asyncio.sleep(0.05)
+        # Same channel: the config is written once and only results are read
+        self.assertEqual(len(self.chip.bus.configs), 1)
+        self.assertFalse(self.chip.bus.configs[0] & 0x0100)
+        reads = [messages for messages in self.chip.bus.transfers if messages == ([0x00], 2)]
+        self.assertGreater(len(reads), 5)
+        thresholds = [messages[0][0] for messages in self.chip.bus.transfers[:2]]
+        self.assertEqual(thresholds, [0x03, 0x02])
+
+
+class ADS1115CaptureTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.chip = ADS1115Scanner(data_rate=860)
+        self.chip.log = Logger()
+        self.chip.bus = self.chip.adc.registers.bus = Bus()
+        # 50 Hz sine around a 1000 offset, 17.2 samples per period
+        self.chip.bus.waveform = [round(1000 + 8000 * math.sin(2 * math.pi * 50 * n / 860)) for n in range(860)]
+        await self.chip.setup()
+        self.dispatcher = Dispatcher(Logger())
+        self.callback = Callback()
+        self.dispatcher.get_broker('test').subscribe(self.callback.function, sender='clamp')
+
+    def test_waveform_stats(self):
+        samples = array('h', [round(100 * math.sin(2 * math.pi * n / 100)) for n in range(1000)])
+        stats = get_waveform_stats(samples)
+        self.assertAlmostEqual(stats['mean'], 0, places=6)
+        self.assertAlmostEqual(stats['rms'], 100 / math.sqrt(2), places=1)
+        self.assertEqual(stats['peak'], 100)
+        self.assertAlmostEqual(stats['crest'], math.sqrt(2), places=2)
+        self.assertEqual(get_waveform_stats(array('h', [5, 5]))['crest'], 0)
+
+    def test_validation(self):
+        with self.assertRaises(ValidationError):
+            ADS1115(mode='capture')
+        with self.assertRaises(ValidationError):
+            ADS1115(mode='burst')
+
+    async def test_capture(self):
+        clamp = ADS1115(
+            hardware_manager=HardwareManager(adc=self.chip),
+            hardware=dict(type='ADS1115', device='adc', channel=1),
+            mode='capture', window=0.1, precision=3, delay=3600,
+        )
+        self.assertEqual(len(clamp.buffer), 86)
+        clamp.log = Logger()
+        clamp.broker = self.dispatcher.get_broker('clamp', callback=clamp._message_received)
+        await clamp.start()
+        await asyncio.sleep(0.15)
+        await clamp.stop()
+        states = dict([(x['topic'], x['payload']) for x in self.callback.called])
+        factor = 4.096 / 32768
+        self.assertAlmostEqual(float(states['value']), 8000 / math.sqrt(2) * factor, delta=0.01)
+        self.assertAlmostEqual(float(states['mean']), 1000 * factor, delta=0.01)
+        self.assertAlmostEqual(float(states['peak']), 8000 * factor, delta=0.01)
+        self.assertAlmostEqual(float(states['crest']), math.sqrt(2), delta=0.02)
+        # Continuous mode, one config write for the whole window
+        self.assertEqual(len(self.chip.bus.configs), 1)
+        self.assertFalse(self.chip.bus.configs[0] & 0x0100)
+        self.assertIsNone(self.chip.task)
+
+
+class ADS1115ThresholdTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        GPIODevice.pin_factory = MockFactory()
+        self.pin = GPIODevice.pin_factory.pin(6)
+        self.chip = ADS1115Scanner(data_rate=860, alert_pin=6)
+        self.chip.log = Logger()
+        self.chip.bus = self.chip.adc.registers.bus = Bus()
+        self.chip.bus.inputs[4] = 1000
+        await self.chip.setup()
+        self.dispatcher = Dispatcher(Logger())
+        self.callback = Callback()
+        self.dispatcher.get_broker('test').subscribe(self.callback.function, sender='level')
+
+    async def asyncTearDown(self):
+        self.chip.alert.close()
+        GPIODevice.pin_factory.reset()
+
+    def get_level(self, chip=None, **kwargs):
+        return ADS1115(
+            hardware_manager=HardwareManager(adc=chip or self.chip),
+            hardware=dict(type='ADS1115', device='adc', channel=0),
+            mode='threshold', precision=3, **kwargs
+        )
+
+    def get_states(self):
+        return [(x['topic'], x['payload']) for x in self.callback.called if x['topic'] in ('alert', 'value')]
+
+    def test_validation(self):
+        # A chip each: the channel stays configured after a failed validation
+        get_chip = lambda: ADS1115Scanner(alert_pin=6)
+        with self.assertRaises(ValidationError):
+            self.get_level(chip=get_chip())
+        with self.assertRaises(ValidationError):
+            self.get_level(chip=get_chip(), high_threshold=1, low_threshold=2)
+        # Full scale is 4.096 V at gain 1
+        with self.assertRaises(ValidationError):
+            self.get_level(chip=get_chip(), high_threshold=5)
+        with self.assertRaises(ValidationError):
+            self.get_level(chip=get_chip(), high_threshold=1, low_threshold=-4.2)
+        chip = get_chip()
+        self.get_level(chip=chip, high_threshold=4.09, low_threshold=-4.096)
+        with self.assertRaises(ValidationError):
+            ADS1x15Input(device=chip, channel=1)
+        chip = ADS1115Scanner()
+        ADS1x15Input(device=chip, channel=1)
+        with self.assertRaises(ValidationError):
+            ADS1x15Input(device=chip, channel=0, comparator=True)
+
+    async def alert(self, value):
+        self.chip.bus.inputs[4] = value
+        self.pin.drive_low()
+        await asyncio.sleep(0.02)
+        self.pin.drive_high()
+
+    async def test_threshold(self):
+        level = self.get_level(high_threshold=1, low_threshold=0.5)
+        level.log = Logger()
+        level.broker = self.dispatcher.get_broker('level', callback=level._message_received)
+        await level.start()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.get_states(), [('alert', 'off'), ('value', Decimal('0.125'))])
+        # Armed for a crossing above 1 V only
+        self.assertEqual(self.chip.bus.thresholds, {0x03: 8000, 0x02: -0x8000})
+        self.assertTrue(self.chip.bus.configs[-1] & 0x0010)
+        self.assertTrue(self.chip.bus.configs[-1] & 0x0004)
+        transfers = len(self.chip.bus.transfers)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.chip.bus.transfers), transfers)
+        await self.alert(9000)
+        self.assertEqual(self.get_states()[2:], [('alert', 'on'), ('value', Decimal('1.125'))])
+        # Now armed for a drop below 0.5 V
+        self.assertEqual(self.chip.bus.thresholds, {0x03: 0x7FFF, 0x02: 4000})
+        await self.alert(6000)
+        self.assertEqual(self.get_states()[4:], [('alert', 'on'), ('value', Decimal('0.75'))])
+        await self.alert(3000)
+        self.assertEqual(self.get_states()[6:], [('alert', 'off'), ('value', Decimal('0.375'))])
+        self.assertEqual(len(self.chip.bus.configs), 1)
+        await level.stop()
+        self.assertEqual(self.chip.bus.configs[-1], 0x8583)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import unittest
 from tempfile import TemporaryDirectory
@@ -32,6 +33,8 @@ class GetConfigTest(unittest.TestCase):
         self.assertEqual(config['name'], 'brick')
 
     def test_default_sync(self):
+        # Isolated asyncio tests leave no current event loop behind
+        asyncio.set_event_loop(asyncio.new_event_loop())
         with TemporaryDirectory() as config_dir:
             config_file = os.path.join(config_dir, 'config.yml')
             config = ConfigManager(config_dir=config_dir).get_sync()
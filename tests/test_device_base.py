@@ -1,5 +1,11 @@
+import asyncio
 import unittest
+from gpiozero import Device as GPIODevice
+from gpiozero.pins.mock import MockFactory
+from .test import Callback, Logger
 from brick.device import base
+from brick.exceptions import ValidationError
+from brick.message import Dispatcher
 
 
 class SingleClickHandlerTest(unittest.TestCase):
@@ -32,3 +38,70 @@ class LongClickHandlerTest(unittest.TestCase):
         self.assertEqual(handler.get_events(True, ms=1200), [])
         self.assertEqual(handler.get_events(False, ms=1500), ['end'])
         self.assertEqual(handler.get_events(False, ms=1550), [])
+
+
+class ButtonEdgeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        GPIODevice.pin_factory = MockFactory()
+        self.pin = GPIODevice.pin_factory.pin(17)
+        self.dispatcher = Dispatcher(Logger())
+        self.callback = Callback()
+        self.dispatcher.get_broker('test').subscribe(self.callback.function, sender='button', topic='click')
+
+    async def asyncTearDown(self):
+        await self.button.stop()
+        self.button.hardware.input.close()
+        GPIODevice.pin_factory.reset()
+
+    async def get_button(self, **kwargs):
+        self.button = base.Button(hardware=dict(type='GPIO', pin=17), **kwargs)
+        self.button.log = Logger()
+        self.button.broker = self.dispatcher.get_broker('button', callback=self.button._message_received)
+        await self.button.start()
+        await asyncio.sleep(0.01)
+        return self.button
+
+    def get_clicks(self):
+        return [x['payload'] for x in self.callback.called if x['payload'] != 'none']
+
+    async def test_mode(self):
+        button = await self.get_button()
+        self.assertTrue(button.edge)
+        self.assertFalse(base.Button(hardware=dict(type='GPIO', pin=18), mode='poll').edge)
+        with self.assertRaises(ValidationError):
+            base.Button(hardware=dict(type='GPIO', pin=18), mode='interrupt')
+
+    async def test_click(self):
+        await self.get_button(debounce=20)
+        self.pin.drive_low()
+        await asyncio.sleep(0.005)
+        self.assertEqual(self.get_clicks(), ['begin', 'single'])
+        self.pin.drive_high()
+        await asyncio.sleep(0.03)
+        self.assertEqual(self.get_clicks(), ['begin', 'single', 'end'])
+
+    async def test_bounce(self):
+        await self.get_button(debounce=20)
+        for _ in range(3):
+            self.pin.drive_low()
+            self.pin.drive_high()
+        self.pin.drive_low()
+        await asyncio.sleep(0.03)
+        self.assertEqual(self.get_clicks(), ['begin', 'single'])
+        # Released while bouncing: applied once the contact settles
+        self.pin.drive_high()
+        self.pin.drive_low()
+        self.pin.drive_high()
+        await asyncio.sleep(0.005)
+        self.assertEqual(self.get_clicks(), ['begin', 'single', 'end'])
+        await asyncio.sleep(0.03)
+        self.assertEqual(self.get_clicks(), ['begin', 'single', 'end'])
+
+    async def test_long_click(self):
+        await self.get_button(debounce=10, long_click=50)
+        self.pin.drive_low()
+        await asyncio.sleep(0.07)
+        self.assertEqual(self.get_clicks(), ['begin', 'long'])
+        self.pin.drive_high()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.get_clicks(), ['begin', 'long', 'end'])
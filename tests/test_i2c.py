@@ -0,0 +1,174 @@
+import asyncio
+import time
+import unittest
+from .test import Chip, ErrorChip
+from brick.exceptions import ValidationError
+from brick.hardware.i2c import I2CBus, RegisterCache
+
+
+class SMBus:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.calls = []
+        self.messages = []
+
+    def read_byte_data(self, address, register):
+        self.calls.append(address)
+        time.sleep(self.delay)
+        return 0
+
+    def i2c_rdwr(self, *messages):
+        self.calls.append(messages[0].addr)
+        self.messages.append(messages)
+        for message in messages:
+            if message.flags:
+                for index in range(message.len):
+                    message.buf[index] = bytes([index + 1])
+        time.sleep(self.delay)
+
+
+class I2CBusTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bus = I2CBus(0)
+        self.bus.smbus = SMBus()
+        self.high = self.bus.get_client('high')
+        self.normal = self.bus.get_client('normal')
+        self.low = self.bus.get_client('low')
+
+    def test_priority_validation(self):
+        with self.assertRaises(ValidationError):
+            self.bus.get_client('urgent')
+
+    async def test_serialized(self):
+        self.bus.smbus.delay = 0.005
+        start = asyncio.get_event_loop().time()
+        await asyncio.gather(*[self.normal.read_byte_data(address, 0) for address in range(4)])
+        self.assertGreaterEqual(asyncio.get_event_loop().time() - start, 0.019)
+        self.assertEqual(self.bus.smbus.calls, [0, 1, 2, 3])
+        self.assertFalse(self.bus.busy)
+
+    async def test_priority(self):
+        await asyncio.gather(
+            self.low.read_byte_data(1, 0),
+            self.low.read_byte_data(2, 0),
+            self.normal.read_byte_data(3, 0),
+            self.high.write_byte_data(4, 0, 0),
+            self.high.read_byte_data(5, 0),
+        )
+        # The first one already owns the bus, then by priority and FIFO
+        self.assertEqual(self.bus.smbus.calls, [1, 4, 5, 3, 2])
+
+    async def test_starvation(self):
+        self.bus.max_wait = 0.015
+        async def flood():
+            for _ in range(10):
+                await self.high.read_byte_data(1, 0)
+        await asyncio.gather(flood(), flood(), self.low.read_byte_data(2, 0))
+        self.assertLess(self.bus.smbus.calls.index(2), 5)
+
+    async def test_cancel(self):
+        tasks = [asyncio.create_task(self.normal.read_byte_data(address, 0)) for address in range(3)]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertEqual(self.bus.smbus.calls, [0, 2])
+        self.assertFalse(self.bus.busy)
+
+    async def test_cancel_release(self):
+        # Cancelled in the same loop iteration as the release
+        await self.bus.acquire('normal')
+        task = asyncio.create_task(self.bus.acquire('normal'))
+        await asyncio.sleep(0)
+        task.cancel()
+        self.bus.release()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertFalse(self.bus.busy)
+        await asyncio.wait_for(self.normal.read_byte_data(1, 0), 1)
+        self.assertEqual(self.bus.smbus.calls, [1])
+
+    async def test_error(self):
+        def error(address, register):
+            raise OSError('Remote I/O error')
+        self.bus.smbus.read_byte_data = error
+        with self.assertRaises(OSError):
+            await self.normal.read_byte_data(1, 0)
+        self.assertFalse(self.bus.busy)
+
+    async def test_transfer(self):
+        data = await self.normal.transfer(0x20, [0x00, 0xff, 0x00], [0x14], 2, [0x12], 1)
+        self.assertEqual(data, [[1, 2], [1]])
+        messages = self.bus.smbus.messages
+        self.assertEqual(len(messages), 1)
+        self.assertEqual([list(message) for message in messages[0]], [[0x00, 0xff, 0x00], [0x14], [1, 2], [0x12], [1]])
+        self.assertEqual(await self.normal.read_i2c_block_data(0x20, 0x14, 2), [1, 2])
+        await self.normal.write_byte_data(0x20, 0x14, 0x0f)
+        self.assertEqual(list(messages[-1][0]), [0x14, 0x0f])
+        self.assertEqual(self.bus.get_stats()['priorities']['normal']['transactions'], 3)
+
+    async def test_stats(self):
+        await asyncio.gather(*[self.low.read_byte_data(address, 0) for address in range(3)])
+        stats = self.bus.get_stats()
+        self.assertGreater(stats['utilization'], 0.5)
+        self.assertEqual(stats['priorities']['low']['transactions'], 3)
+        self.assertEqual(stats['priorities']['low']['waiting'], 0)
+        self.assertGreater(stats['priorities']['low']['max_wait'], 0.015)
+        self.assertEqual(stats['priorities']['high']['transactions'], 0)
+
+
+class RegisterCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.chip = Chip()
+        self.cache = RegisterCache(self.chip, 0x20, volatile=[0x12, 0x13])
+
+    async def test_skip(self):
+        await self.cache.write(0x00, [0xff, 0x0f])
+        await self.cache.write(0x00, [0xff, 0x0f])
+        self.assertEqual(self.chip.transfers, [([0x00, 0xff, 0x0f],)])
+        self.assertEqual(self.cache.get(0x01), (0x0f,))
+
+    async def test_changed_range(self):
+        await self.cache.write(0x14, [0, 0, 0])
+        await self.cache.write(0x14, [0, 1, 0])
+        await self.cache.write(0x14, [1, 1, 1])
+        self.assertEqual(self.chip.transfers[1:], [([0x15, 1],), ([0x14, 1, 1, 1],)])
+
+    async def test_force(self):
+        await self.cache.write(0x00, [1])
+        await self.cache.write(0x00, [1], force=True)
+        self.assertEqual(len(self.chip.transfers), 2)
+
+    async def test_read(self):
+        self.chip.registers[0x14] = 3
+        self.assertEqual(await self.cache.read(0x14, 2), [3, 0])
+        await self.cache.write(0x14, [3, 0])
+        self.assertEqual(len(self.chip.transfers), 1)
+        self.assertEqual(await self.cache.read(0x12, 2), [0, 0])
+        self.assertIsNone(self.cache.get(0x12))
+
+    async def test_volatile(self):
+        await self.cache.write(0x12, [1])
+        await self.cache.write(0x12, [1])
+        self.assertEqual(len(self.chip.transfers), 2)
+
+    async def test_transfer(self):
+        data = await self.cache.transfer(writes=[(0x00, [1]), (0x0C, [2])], reads=[(0x12, 1)])
+        self.assertEqual(data, [[0]])
+        self.assertEqual(self.chip.transfers, [([0x00, 1], [0x0C, 2], [0x12], 1)])
+        self.assertEqual(await self.cache.transfer(writes=[(0x00, [1])]), [])
+        self.assertEqual(len(self.chip.transfers), 1)
+
+    async def test_word(self):
+        cache = RegisterCache(self.chip, 0x48, width=2)
+        await cache.write(0x01, [0x85, 0x83])
+        await cache.write(0x01, [0x85, 0x83])
+        await cache.write(0x01, [0x85, 0x84])
+        self.assertEqual(self.chip.transfers, [([0x01, 0x85, 0x83],), ([0x01, 0x85, 0x84],)])
+        self.assertEqual(cache.get(0x01), (0x85, 0x84))
+
+    async def test_error(self):
+        await self.cache.write(0x00, [1])
+        self.cache.bus = ErrorChip()
+        with self.assertRaises(OSError):
+            await self.cache.write(0x01, [1])
+        self.assertIsNone(self.cache.get(0x00))
@@ -0,0 +1,239 @@
+import asyncio
+import unittest
+from unittest import mock
+from brick.logging import DEBUG, ERROR, INFO, NOTSET, WARNING, LogCollector, RingBufferLogConsumer, StdoutLogConsumer
+
+
+class Consumer:
+    def __init__(self):
+        self.logged = []
+
+    async def log(self, timestamp, level, component, message):
+        self.logged.append((level, component, message))
+
+
+class LogCollectorThresholdTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log_collector = LogCollector()
+
+    def test_no_consumers(self):
+        self.assertEqual(self.log_collector.get_threshold('app'), NOTSET)
+        self.assertFalse(self.log_collector.get_logger('app').is_enabled_for(ERROR))
+
+    def test_level(self):
+        self.log_collector.add_consumer(Consumer().log, level='warning')
+        logger = self.log_collector.get_logger('app')
+        self.assertFalse(logger.is_enabled_for(INFO))
+        self.assertTrue(logger.is_enabled_for(WARNING))
+
+    def test_components(self):
+        self.log_collector.add_consumer(Consumer().log, level='warning', components=dict(mqtt='debug'))
+        self.log_collector.add_consumer(Consumer().log, level='info', components=dict(web='error'))
+        self.assertEqual(self.log_collector.get_threshold('app'), INFO)
+        self.assertEqual(self.log_collector.get_threshold('mqtt'), DEBUG)
+        self.assertEqual(self.log_collector.get_threshold('web'), WARNING)
+
+    def test_consumer_changes(self):
+        logger = self.log_collector.get_logger('app')
+        self.assertFalse(logger.is_enabled_for(DEBUG))
+        consumer_id = self.log_collector.add_consumer(Consumer().log, level='debug')
+        self.assertTrue(logger.is_enabled_for(DEBUG))
+        self.log_collector.remove_consumer(consumer_id)
+        self.assertFalse(logger.is_enabled_for(DEBUG))
+
+
+class LogCollectorLogTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log_collector = LogCollector()
+        self.consumer = Consumer()
+        self.log_collector.add_consumer(self.consumer.log, level='info', components=dict(mqtt='debug'))
+
+    async def test_deferred_arguments(self):
+        self.log_collector.get_logger('mqtt').debug('set_state %s %s', 'power', 'on')
+        self.log_collector.get_logger('app').info('value 100%')
+        await asyncio.sleep(0)
+        self.assertEqual(self.consumer.logged, [
+            (DEBUG, 'mqtt', 'set_state power on'),
+            (INFO, 'app', 'value 100%'),
+        ])
+
+    async def test_not_formatted(self):
+        class Payload:
+            def __str__(self):
+                raise AssertionError('formatted')
+        self.log_collector.get_logger('app').debug('set_state %s', Payload())
+        self.assertEqual(self.consumer.logged, [])
+
+
+class BatchConsumer:
+    def __init__(self):
+        self.batches = []
+
+    async def log(self, records):
+        self.batches.append([(level, component, message) for timestamp, level, component, message in records])
+
+
+class LogCollectorBatchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log_collector = LogCollector(buffer_size=5, batch_size=2)
+        self.consumer = BatchConsumer()
+        self.log_collector.add_consumer(self.consumer.log, level='info', batch=True)
+        self.log = self.log_collector.get_logger('app')
+
+    async def test_batch(self):
+        for number in range(3):
+            self.log.info('line %d', number)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.consumer.batches, [
+            [(INFO, 'app', 'line 0'), (INFO, 'app', 'line 1')],
+            [(INFO, 'app', 'line 2')],
+        ])
+        self.assertEqual(len(asyncio.all_tasks()), 1)
+
+    async def test_dropped(self):
+        for number in range(8):
+            self.log.info('line %d', number)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.consumer.batches, [
+            [(WARNING, 'log', '3 log records dropped'), (INFO, 'app', 'line 3')],
+            [(INFO, 'app', 'line 4'), (INFO, 'app', 'line 5')],
+            [(INFO, 'app', 'line 6'), (INFO, 'app', 'line 7')],
+        ])
+
+
+class StdoutLogConsumerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_single_write(self):
+        log_collector = LogCollector()
+        StdoutLogConsumer(log_collector, level='info')
+        log = log_collector.get_logger('app')
+        with mock.patch('sys.stdout') as stdout:
+            log.info('first')
+            log.warning('second')
+            await asyncio.sleep(0.01)
+        self.assertEqual(stdout.write.call_count, 1)
+        lines = stdout.write.call_args[0][0].splitlines()
+        self.assertEqual([line.split(' ', 1)[1] for line in lines], [
+            'INFO     app: first',
+            'WARNING  app: second',
+        ])
+
+
+class RingBufferLogConsumerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log_collector = LogCollector()
+        self.buffer = RingBufferLogConsumer(self.log_collector, size=3, level='debug')
+
+    def get_messages(self, **kwargs):
+        return [(record[1], record[2], record[3]) for record in self.buffer.get_records(**kwargs)]
+
+    async def test_empty(self):
+        self.assertEqual(self.buffer.get_records(), [])
+
+    async def test_fixed_size(self):
+        log = self.log_collector.get_logger('app')
+        for number in range(5):
+            log.info('line %d', number)
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self.buffer.records), 3)
+        self.assertEqual(self.get_messages(), [
+            (INFO, 'app', 'line 2'),
+            (INFO, 'app', 'line 3'),
+            (INFO, 'app', 'line 4'),
+        ])
+
+    async def test_filter(self):
+        self.log_collector.get_logger('app').debug('debug')
+        self.log_collector.get_logger('app').error('error')
+        self.log_collector.get_logger('mqtt').info('info')
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.get_messages(level='info'), [(ERROR, 'app', 'error'), (INFO, 'mqtt', 'info')])
+        self.assertEqual(self.get_messages(component='app'), [(DEBUG, 'app', 'debug'), (ERROR, 'app', 'error')])
+
+    async def test_stream(self):
+        stream = self.buffer.stream(level='info', component='app')
+        task = asyncio.create_task(stream.__anext__())
+        await asyncio.sleep(0)
+        self.log_collector.get_logger('app').debug('debug')
+        self.log_collector.get_logger('mqtt').info('other')
+        self.log_collector.get_logger('app').info('info')
+        record = await task
+        self.assertEqual(record[1:], (INFO, 'app', 'info'))
+        await stream.aclose()
+        self.assertEqual(self.buffer.streams, set())
+
+
+class LoggerExceptionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log_collector = LogCollector(exception_interval=60)
+        self.consumer = Consumer()
+        self.log_collector.add_consumer(self.consumer.log, level='info')
+        self.log = self.log_collector.get_logger('app')
+
+    def raise_exception(self, message='loop error', error=None, now=0):
+        with mock.patch('brick.logging.monotonic', return_value=now):
+            try:
+                raise error or OSError('Remote I/O error')
+            except Exception as error:
+                self.log.exception(message, error)
+
+    async def get_messages(self):
+        await asyncio.sleep(0.01)
+        messages = [x[2] for x in self.consumer.logged]
+        self.consumer.logged = []
+        return messages
+
+    async def test_traceback(self):
+        self.raise_exception()
+        messages = await self.get_messages()
+        self.assertEqual(messages[0], 'loop error')
+        self.assertIn('OSError: Remote I/O error', messages[1])
+
+    async def test_repeated(self):
+        self.raise_exception(now=0)
+        self.assertEqual(len(await self.get_messages()), 2)
+        with mock.patch('traceback.print_exc') as print_exc:
+            self.raise_exception(now=10)
+            self.raise_exception(now=20)
+            self.assertEqual(await self.get_messages(), [])
+            self.raise_exception(now=60)
+            self.assertEqual(await self.get_messages(), ['loop error - repeated 3 times'])
+            self.raise_exception(now=70)
+            self.assertEqual(await self.get_messages(), [])
+        self.assertEqual(print_exc.call_count, 0)
+
+    async def test_different(self):
+        self.raise_exception(now=0)
+        self.raise_exception(now=10)
+        self.raise_exception(error=ValueError('wrong'), now=20)
+        messages = await self.get_messages()
+        self.assertEqual(messages[2], 'loop error - repeated 1 times')
+        self.assertEqual(messages[3], 'loop error')
+        self.assertIn('ValueError: wrong', messages[4])
+
+    async def test_alternating(self):
+        with mock.patch('traceback.print_exc') as print_exc:
+            for now in range(0, 50, 10):
+                self.raise_exception(message='poller', now=now)
+                self.raise_exception(message='interrupt', now=now)
+            self.assertEqual(print_exc.call_count, 2)
+            self.raise_exception(message='poller', now=60)
+        messages = await self.get_messages()
+        self.assertEqual(messages[::2], ['poller', 'interrupt', 'poller - repeated 5 times'])
+
+    async def test_flush(self):
+        self.log_collector.exception_interval = 0.02
+        self.raise_exception()
+        self.raise_exception()
+        self.raise_exception()
+        self.assertEqual(len(await self.get_messages()), 2)
+        await asyncio.sleep(0.02)
+        self.assertEqual(await self.get_messages(), ['loop error - repeated 2 times'])
+        self.assertIsNone(self.log.exception_timer)
+
+    async def test_no_error(self):
+        try:
+            raise OSError('Remote I/O error')
+        except Exception:
+            self.log.exception('on_message')
+        messages = await self.get_messages()
+        self.assertIn('OSError: Remote I/O error', messages[1])
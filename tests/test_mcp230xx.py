@@ -0,0 +1,221 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from gpiozero import Device as GPIODevice
+from gpiozero.pins.mock import MockFactory
+from .test import Chip, ErrorChip, Logger
+from brick.exceptions import HardwareError
+from brick.hardware import HardwareManager
+from brick.hardware.i2c import i2c_manager
+from brick.logging import LogCollector
+from brick.message import Dispatcher
+from brick.hardware.mcp.mcp230xx import MCP23017, MCP23017Input, MCP23017Output
+
+
+def get_bus():
+    # Inputs pulled up: GPIOA and GPIOB read high
+    return Chip({0x12: 0xff, 0x13: 0xff})
+
+
+class HardwareManagerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = HardwareManager(LogCollector(), Dispatcher(Logger()), dict(
+            mcp0=dict(type='MCP23017', address=0x20),
+            mcp1=dict(type='MCP23017', address=0x21),
+            mcp2=dict(type='MCP23017', address=0x22),
+        ))
+        self.manager.log = Logger()
+        for name, chip in self.manager.hardware.items():
+            chip.registers.bus = ErrorChip() if name == 'mcp2' else get_bus()
+        chip = self.manager.hardware['mcp0']
+        self.channels = [MCP23017Input(device=chip, port='a', channel=c) for c in range(8)]
+        self.channels += [MCP23017Output(device=chip, port='b', channel=c) for c in range(8)]
+
+    async def test_start(self):
+        with patch.object(i2c_manager, 'bus', dict()):
+            await self.manager.start()
+        for channel in self.channels:
+            await channel.setup()
+        bus = self.manager.hardware['mcp0'].registers.bus
+        self.assertEqual(len(bus.transfers), 1)
+        self.assertEqual(bus.writes, [(0x00, 0xff), (0x01, 0), (0x0C, 0xff), (0x0D, 0)])
+        self.assertEqual(bus.reads, [0x14, 0x12])
+        self.assertEqual(len(self.manager.hardware['mcp1'].registers.bus.transfers), 1)
+        self.assertEqual(self.manager.log.logged, [('exception', 'mcp2 setup error')])
+        self.assertTrue(self.manager.hardware['mcp0'].ready)
+        self.assertFalse(self.manager.hardware['mcp2'].ready)
+        await self.manager.stop()
+
+    async def test_setup_retry(self):
+        chip = self.manager.hardware['mcp2']
+        chip.setup_min_delay = 0.02
+        output = MCP23017Output(device=chip, port='a', channel=0)
+        with patch.object(i2c_manager, 'bus', dict()):
+            await self.manager.start()
+        # Not configured: the output must not pretend to be on
+        with self.assertRaises(HardwareError):
+            await output.set_state('on')
+        with self.assertRaises(HardwareError):
+            await output.get_state()
+        chip.registers.bus = get_bus()
+        await asyncio.sleep(0.05)
+        self.assertTrue(chip.ready)
+        self.assertEqual(self.manager.tasks, dict())
+        await output.set_state('on')
+        self.assertEqual(chip.registers.bus.writes[:2], [(0x00, 0), (0x01, 0)])
+        self.assertEqual(chip.registers.bus.writes[-1], (0x14, 1))
+        self.assertEqual(await output.get_state(), 'on')
+
+    async def test_reset(self):
+        chip = self.manager.hardware['mcp0']
+        chip.setup_min_delay = 0
+        with patch.object(i2c_manager, 'bus', dict()):
+            await self.manager.start()
+        await self.channels[8].set_state('on')
+        bus = chip.registers.bus
+        chip.registers.bus = ErrorChip()
+        with self.assertRaises(OSError):
+            await self.channels[9].set_state('on')
+        self.assertFalse(chip.ready)
+        # Chip reset: direction, pull-ups and outputs are written again
+        bus.writes = []
+        chip.registers.bus = bus
+        await self.channels[10].set_state('on')
+        self.assertTrue(chip.ready)
+        self.assertEqual(bus.writes, [
+            (0x00, 0xff), (0x01, 0), (0x0C, 0xff), (0x0D, 0), (0x14, 0), (0x15, 0b11), (0x15, 0b111),
+        ])
+
+
+class MCP23017InterruptTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        GPIODevice.pin_factory = MockFactory()
+        self.pin = GPIODevice.pin_factory.pin(4)
+        self.chip = MCP23017(interrupt_pin=4)
+        self.chip.log = Logger()
+        self.chip.registers.bus = get_bus()
+        self.inputs = [MCP23017Input(device=self.chip, port='a', channel=c) for c in (0, 1)]
+        self.inputs.append(MCP23017Input(device=self.chip, port='b', channel=7))
+        self.edges = []
+        for index, channel in enumerate(self.inputs):
+            await channel.watch(lambda pressed, ms, index=index: self.edges.append((index, pressed)))
+        await self.chip.setup()
+
+    async def asyncTearDown(self):
+        self.chip.interrupt.close()
+        GPIODevice.pin_factory.reset()
+
+    def test_setup(self):
+        self.assertTrue(self.inputs[0].edge)
+        writes = self.chip.registers.bus.writes
+        self.assertIn((0x0A, 0x40), writes)
+        self.assertIn((0x04, 0b00000011), writes)
+        self.assertIn((0x05, 0b10000000), writes)
+        self.assertIn((0x08, 0), writes)
+
+    async def test_interrupt(self):
+        self.chip.registers.bus.registers[0x12] = 0b11111110
+        self.pin.drive_low()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.edges, [(0, True)])
+        self.pin.drive_high()
+        self.chip.registers.bus.registers[0x12] = 0b11111111
+        self.chip.registers.bus.registers[0x13] = 0b01111111
+        self.pin.drive_low()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.edges, [(0, True), (0, False), (2, True)])
+
+    async def test_unwatch(self):
+        await self.inputs[0].watch(None)
+        self.chip.registers.bus.registers[0x12] = 0b11111100
+        self.pin.drive_low()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.edges, [(1, True)])
+
+
+class MCP23017PollerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.chip = MCP23017()
+        self.chip.log = Logger()
+        self.chip.registers.bus = get_bus()
+        self.inputs = [MCP23017Input(device=self.chip, port=p, channel=c, delay=10) for p in ('a', 'b') for c in range(8)]
+        await self.chip.setup()
+        self.edges = []
+        for index, channel in enumerate(self.inputs):
+            await channel.watch(lambda pressed, ms, index=index: self.edges.append((index, pressed)))
+
+    async def asyncTearDown(self):
+        for channel in self.inputs:
+            await channel.watch(None)
+
+    async def test_poller(self):
+        self.assertIsNotNone(self.chip.poller_task)
+        reads = len(self.chip.registers.bus.reads)
+        await asyncio.sleep(0.055)
+        # One 2 byte read every 10 ms for all 16 channels
+        self.assertIn(len(self.chip.registers.bus.reads) - reads, range(3, 8))
+        self.assertEqual(set(self.chip.registers.bus.reads[reads:]), set([0x12]))
+        self.assertEqual(self.edges, [])
+
+    async def test_changed(self):
+        self.chip.registers.bus.registers[0x12] = 0b11110111
+        self.chip.registers.bus.registers[0x13] = 0b11111110
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.edges, [(3, True), (8, True)])
+        self.chip.registers.bus.registers[0x13] = 0b11111111
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.edges, [(3, True), (8, True), (8, False)])
+
+    async def test_get_channel_state(self):
+        self.chip.registers.bus.registers[0x12] = 0b11111110
+        await asyncio.sleep(0.02)
+        reads = len(self.chip.registers.bus.reads)
+        self.assertEqual(await self.inputs[0].get_state(), 'on')
+        self.assertEqual(await self.inputs[1].get_state(), 'off')
+        self.assertEqual(len(self.chip.registers.bus.reads), reads)
+
+    async def test_stop(self):
+        for channel in self.inputs:
+            await channel.watch(None)
+        self.assertIsNone(self.chip.poller_task)
+
+
+class MCP23017OutputTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.chip = MCP23017()
+        self.chip.log = Logger()
+        self.chip.registers.bus = get_bus()
+        self.chip.registers.bus.registers[0x14] = 0b00000001
+        self.outputs = [MCP23017Output(device=self.chip, port=p, channel=c) for p in ('a', 'b') for c in range(8)]
+        await self.chip.setup()
+        self.chip.registers.bus.writes = []
+        self.chip.registers.bus.transfers = []
+
+    async def test_initial(self):
+        self.assertEqual(self.chip.olat, dict(a=0b00000001, b=0))
+        reads = len(self.chip.registers.bus.reads)
+        self.assertEqual(await self.outputs[0].get_state(), 'on')
+        self.assertEqual(await self.outputs[1].get_state(), 'off')
+        self.assertEqual(len(self.chip.registers.bus.reads), reads)
+
+    async def test_coalesce_port(self):
+        await asyncio.gather(*[output.set_state('on') for output in self.outputs[:8]])
+        self.assertEqual(len(self.chip.registers.bus.transfers), 1)
+        self.assertEqual(self.chip.registers.bus.writes, [(0x14, 0xff)])
+
+    async def test_coalesce_ports(self):
+        await asyncio.gather(self.outputs[1].set_state('on'), self.outputs[9].set_state('on'))
+        self.assertEqual(len(self.chip.registers.bus.transfers), 1)
+        self.assertEqual(self.chip.registers.bus.writes, [(0x14, 0b00000011), (0x15, 0b00000010)])
+
+    async def test_unchanged(self):
+        await self.outputs[0].set_state('on')
+        self.assertEqual(len(self.chip.registers.bus.transfers), 0)
+        await self.outputs[0].set_state('off')
+        await self.outputs[0].set_state('on')
+        self.assertEqual(self.chip.registers.bus.writes, [(0x14, 0), (0x14, 1)])
+
+    async def test_setup_cached(self):
+        await self.chip.setup()
+        self.assertEqual(self.chip.registers.bus.writes, [])
+        self.assertEqual(len(self.chip.registers.bus.transfers), 1)
@@ -1,7 +1,8 @@
 import asyncio
 import unittest
 from .test import Callback, Logger
-from brick.message import Broker, Dispatcher
+from brick.exceptions import ValidationError
+from brick.message import Broker, Dispatcher, fast_callback
 
 
 class DispatcherTest(unittest.IsolatedAsyncioTestCase):
@@ -319,3 +320,277 @@ class DispatcherLongCallbackTest(unittest.IsolatedAsyncioTestCase):
         await task
         self.assertEqual(self.callback_1.called, [dict(sender='c', topic='state', payload='online')])
         self.assertEqual(self.callback_2.called, [dict(sender='c', topic='state', payload='online')])
+
+
+class DispatcherRouteTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.log = Logger()
+        self.dispatcher = Dispatcher(log=self.log)
+        self.broker = self.dispatcher.get_broker('c')
+        self.broker_1 = self.dispatcher.get_broker('c1')
+        self.broker_2 = self.dispatcher.get_broker('c2')
+        self.callback_1 = Callback()
+        self.callback_2 = Callback()
+
+    async def test_route_cached(self):
+        self.broker_1.subscribe(self.callback_1.function, topic='state')
+        await self.broker.publish(topic='state', payload='online')
+        self.assertEqual(list(self.dispatcher.routes.keys()), [('c', 'state')])
+        route = self.dispatcher.routes[('c', 'state')]
+        await self.broker.publish(topic='state', payload='offline')
+        self.assertIs(self.dispatcher.routes[('c', 'state')], route)
+        self.assertEqual(len(self.callback_1.called), 2)
+
+    async def test_subscribe_drops_route(self):
+        self.broker_1.subscribe(self.callback_1.function, topic='state')
+        await self.broker.publish(topic='state', payload='online')
+        await self.broker.publish(topic='other', payload='online')
+        self.broker_2.subscribe(self.callback_2.function, sender='c', topic='state')
+        self.assertEqual(list(self.dispatcher.routes.keys()), [('c', 'other')])
+        await self.broker.publish(topic='state', payload='offline')
+        self.assertEqual(self.callback_1.called[-1], dict(sender='c', topic='state', payload='offline'))
+        self.assertEqual(self.callback_2.called, [dict(sender='c', topic='state', payload='offline')])
+
+    async def test_unsubscribe_drops_route(self):
+        self.broker_1.subscribe(self.callback_1.function)
+        await self.broker.publish(topic='state', payload='online')
+        await self.broker_2.publish(topic='state', payload='online')
+        self.broker_1.unsubscribe()
+        self.assertEqual(self.dispatcher.routes, dict())
+        await self.broker.publish(topic='state', payload='offline')
+        self.assertEqual(len(self.callback_1.called), 2)
+
+    async def test_unsubscribe_not_subscribed(self):
+        await self.broker.publish(topic='state', payload='online')
+        self.broker_1.unsubscribe(topic='state')
+        self.assertEqual(list(self.dispatcher.routes.keys()), [('c', 'state')])
+
+
+class DispatcherInlineTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.log = Logger()
+        self.dispatcher = Dispatcher(log=self.log, inline=True)
+        self.broker = self.dispatcher.get_broker('c')
+        self.broker_1 = self.dispatcher.get_broker('c1')
+        self.broker_2 = self.dispatcher.get_broker('c2')
+
+    async def test_fast_callback(self):
+        called = []
+        @fast_callback
+        async def fast(**kwargs):
+            called.append(kwargs)
+        self.broker_1.subscribe(fast)
+        await self.broker.publish(topic='state', payload='online')
+        self.assertEqual(called, [dict(sender='c', topic='state', payload='online')])
+        self.assertTrue(self.dispatcher.routes[('c', 'state')][0][2])
+
+    async def test_fast_and_slow(self):
+        slow = Callback(delay=0.01)
+        @fast_callback
+        async def fast(**kwargs):
+            self.assertEqual(slow.called, [])
+        self.broker_1.subscribe(slow.function)
+        self.broker_2.subscribe(fast)
+        await self.broker.publish(topic='state', payload='online')
+        self.assertEqual(slow.called, [dict(sender='c', topic='state', payload='online')])
+        self.assertEqual(self.log.logged, [])
+
+    async def test_send(self):
+        callback = Callback()
+        self.dispatcher.get_broker('c3', callback.function)
+        await self.broker.send('c3', 'event')
+        self.assertEqual(callback.called, [dict(sender='c', topic='event', payload=None)])
+
+    async def test_send_fast_callback(self):
+        called = []
+        @fast_callback
+        async def fast(**kwargs):
+            called.append(kwargs)
+            raise Exception
+        dispatcher = Dispatcher(log=self.log, inline=True, mailbox=dict(size=1))
+        dispatcher.get_broker('c3', fast)
+        await dispatcher.get_broker('c').send('c3', 'event')
+        # Awaited by the delivery, not queued into the recipient mailbox
+        self.assertEqual(called, [dict(sender='c', topic='event', payload=None)])
+        self.assertEqual(dispatcher.mailboxes['c3'].max_depth, 0)
+        self.assertEqual(self.log.logged, [('exception', 'Callback error - c -> c3')])
+
+    async def test_fast_callback_exception(self):
+        @fast_callback
+        async def wrong(**kwargs):
+            raise Exception
+        callback = Callback()
+        self.broker_1.subscribe(wrong)
+        self.broker_2.subscribe(callback.function)
+        await self.broker.publish(topic='state', payload='online')
+        self.assertEqual(self.log.logged, [('exception', 'Callback error - c1 <- c/state')])
+        self.assertEqual(callback.called, [dict(sender='c', topic='state', payload='online')])
+
+
+class DispatcherMailboxTest(unittest.IsolatedAsyncioTestCase):
+    def get_dispatcher(self, **kwargs):
+        self.log = Logger()
+        self.dispatcher = Dispatcher(log=self.log, mailbox=kwargs)
+        self.broker = self.dispatcher.get_broker('c')
+        return self.dispatcher
+
+    async def test_get_broker(self):
+        dispatcher = self.get_dispatcher(size=10, components=dict(c1=dict(policy='latest')))
+        dispatcher.get_broker('c1')
+        stats = dispatcher.get_mailbox_stats()
+        self.assertEqual(stats['c'], dict(size=10, policy='drop_oldest', depth=0, max_depth=0, dropped=0))
+        self.assertEqual(stats['c1'], dict(size=10, policy='latest', depth=0, max_depth=0, dropped=0))
+
+    def test_wrong_policy(self):
+        with self.assertRaises(ValidationError):
+            Dispatcher(log=Logger(), mailbox=dict(policy='wrong'))
+        with self.assertRaises(ValidationError):
+            Dispatcher(log=Logger(), mailbox=dict(components=dict(c=dict(policy='wrong'))))
+        with self.assertRaises(ValidationError):
+            # Publishers never await delivery: no blocking policy
+            Dispatcher(log=Logger(), mailbox=dict(policy='block'))
+
+    async def test_send(self):
+        dispatcher = self.get_dispatcher()
+        callback = Callback()
+        dispatcher.get_broker('c1', callback.function)
+        await self.broker.send('c1', 'event')
+        self.assertEqual(callback.called, [dict(sender='c', topic='event', payload=None)])
+        self.assertIsNone(dispatcher.mailboxes['c1'].task)
+
+    async def test_publish_order(self):
+        dispatcher = self.get_dispatcher()
+        callback = Callback(delay=0.001)
+        dispatcher.get_broker('c1').subscribe(callback.function)
+        self.broker.publish(topic='state', payload=1)
+        await self.broker.publish(topic='state', payload=2)
+        self.assertEqual([x['payload'] for x in callback.called], [1, 2])
+
+    async def test_inline_fast_callback(self):
+        self.log = Logger()
+        dispatcher = Dispatcher(log=self.log, inline=True, mailbox=dict(size=1))
+        broker = dispatcher.get_broker('c')
+        called = []
+        @fast_callback
+        async def fast(**kwargs):
+            called.append(kwargs['payload'])
+        callback = Callback()
+        dispatcher.get_broker('c1').subscribe(fast)
+        dispatcher.get_broker('c2').subscribe(callback.function)
+        tasks = [broker.publish(topic='state', payload=x) for x in range(3)]
+        await asyncio.gather(*tasks)
+        # fast callbacks bypass the mailbox, the others still go through it
+        self.assertEqual(called, [0, 1, 2])
+        self.assertEqual([x['payload'] for x in callback.called], [2])
+        self.assertEqual(dispatcher.mailboxes['c1'].max_depth, 0)
+
+    async def test_drop_oldest(self):
+        dispatcher = self.get_dispatcher(size=2, policy='drop_oldest')
+        callback = Callback()
+        dispatcher.get_broker('c1').subscribe(callback.function)
+        tasks = [self.broker.publish(topic='state', payload=x) for x in range(5)]
+        await asyncio.gather(*tasks)
+        self.assertEqual([x['payload'] for x in callback.called], [3, 4])
+        self.assertEqual(dispatcher.mailboxes['c1'].dropped, 3)
+        self.assertEqual(self.log.logged, [
+            ('warning', 'Mailbox full - c1 (2 queued, 1 dropped)'),
+            ('info', 'Mailbox drained - c1 (3 dropped)'),
+        ])
+
+    async def test_latest(self):
+        dispatcher = self.get_dispatcher(size=2, policy='latest')
+        callback = Callback()
+        dispatcher.get_broker('c1').subscribe(callback.function)
+        tasks = [self.broker.publish(topic='value', payload=x) for x in range(5)]
+        tasks.append(self.broker.publish(topic='delay', payload=10))
+        await asyncio.gather(*tasks)
+        self.assertEqual(callback.called, [
+            dict(sender='c', topic='value', payload=4),
+            dict(sender='c', topic='delay', payload=10),
+        ])
+        self.assertEqual(dispatcher.mailboxes['c1'].dropped, 0)
+
+    async def test_latest_full(self):
+        dispatcher = self.get_dispatcher(size=2, policy='latest')
+        callback = Callback()
+        dispatcher.get_broker('c1').subscribe(callback.function)
+        tasks = [self.broker.publish(topic='state{}'.format(x), payload=x) for x in range(5)]
+        await asyncio.gather(*tasks)
+        # Distinct topics are never dropped
+        self.assertEqual([x['payload'] for x in callback.called], [0, 1, 2, 3, 4])
+        self.assertEqual(dispatcher.get_mailbox_stats()['c1']['max_depth'], 5)
+        self.assertEqual(dispatcher.mailboxes['c1'].dropped, 0)
+        self.assertEqual(self.log.logged[0], ('warning', 'Mailbox full - c1 (3 queued, 0 dropped)'))
+
+    async def test_callback_exception(self):
+        dispatcher = self.get_dispatcher()
+        async def wrong(**kwargs):
+            raise Exception
+        dispatcher.get_broker('c1', wrong)
+        await self.broker.send('c1', 'event')
+        self.assertEqual(self.log.logged, [('exception', 'Callback error - c -> c1')])
+
+
+class DispatcherWildcardTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.log = Logger()
+        self.dispatcher = Dispatcher(log=self.log)
+        self.broker = self.dispatcher.get_broker('c')
+        self.broker_1 = self.dispatcher.get_broker('c1')
+        self.broker_2 = self.dispatcher.get_broker('c2')
+        self.broker_3 = self.dispatcher.get_broker('c3')
+        self.callback_1 = Callback()
+        self.callback_2 = Callback()
+        self.callback_3 = Callback()
+
+    async def test_single_level(self):
+        self.broker_1.subscribe(self.callback_1.function, sender='+', topic='value')
+        self.broker_2.subscribe(self.callback_2.function, topic='set/+')
+        await self.broker.publish(topic='value', payload=1)
+        await self.broker.publish(topic='delay', payload=10)
+        await self.broker.publish(topic='set/power', payload='on')
+        await self.broker.publish(topic='set/power/now', payload='on')
+        self.assertEqual(self.callback_1.called, [dict(sender='c', topic='value', payload=1)])
+        self.assertEqual(self.callback_2.called, [dict(sender='c', topic='set/power', payload='on')])
+
+    async def test_multi_level(self):
+        self.broker_1.subscribe(self.callback_1.function, sender='c', topic='set/#')
+        self.broker_2.subscribe(self.callback_2.function, sender='#')
+        await self.broker.publish(topic='set', payload=1)
+        await self.broker.publish(topic='set/power/now', payload=2)
+        await self.broker.publish(topic='value', payload=3)
+        await self.broker_3.publish(topic='set/power', payload=4)
+        self.assertEqual([x['payload'] for x in self.callback_1.called], [1, 2])
+        self.assertEqual([x['payload'] for x in self.callback_2.called], [1, 2, 3, 4])
+
+    async def test_route_order(self):
+        self.broker_1.subscribe(self.callback_1.function)
+        self.broker_2.subscribe(self.callback_2.function, topic='value')
+        self.broker_3.subscribe(self.callback_3.function, sender='c', topic='value')
+        await self.broker.publish(topic='value', payload=1)
+        route = self.dispatcher.routes[('c', 'value')]
+        self.assertEqual([x[0] for x in route], [' - c3 <- c/value', ' - c2 <- c/value', ' - c1 <- c/value'])
+
+    async def test_drop_routes(self):
+        await self.broker.publish(topic='value', payload=1)
+        await self.broker.publish(topic='delay', payload=1)
+        self.broker_1.subscribe(self.callback_1.function, sender='+', topic='value')
+        self.assertEqual(list(self.dispatcher.routes.keys()), [('c', 'delay')])
+        await self.broker.publish(topic='value', payload=2)
+        self.assertEqual(self.callback_1.called, [dict(sender='c', topic='value', payload=2)])
+
+    async def test_unsubscribe(self):
+        self.broker_1.subscribe(self.callback_1.function, topic='set/#')
+        self.broker_1.unsubscribe(topic='set/#')
+        self.assertEqual(self.dispatcher.topic_trie.root.children, dict())
+        await self.broker.publish(topic='set/power', payload='on')
+        self.assertEqual(self.callback_1.called, [])
+
+    async def test_invalid_pattern(self):
+        self.broker_1.subscribe(self.callback_1.function, topic='#/value')
+        self.broker_1.subscribe(self.callback_1.function, topic='val+')
+        self.assertEqual(self.log.logged, [
+            ('error', 'Invalid pattern - c1 -> None/#/value'),
+            ('error', 'Invalid pattern - c1 -> None/val+'),
+        ])
+        self.assertEqual(self.dispatcher.subscriptions, dict())
@@ -0,0 +1,313 @@
+import asyncio
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from decimal import Decimal
+from .test import Callback, Logger
+from brick.device import Device
+from brick.exceptions import ValidationError
+from brick.message import Dispatcher
+from brick.mqtt import Mqtt, Spool
+
+
+class Client:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.is_connected = True
+        self.inflight = 0
+        self.max_inflight = 0
+        self.published = []
+
+    async def publish(self, topic, message, qos=None, retain=None):
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        await asyncio.sleep(self.delay)
+        self.inflight -= 1
+        self.published.append((topic, message, retain, qos))
+
+
+class MqttTest(unittest.IsolatedAsyncioTestCase):
+    def get_mqtt(self, client=None, config_dir=None, **config):
+        dispatcher = Dispatcher(Logger())
+        self.broker = dispatcher.get_broker('sensor')
+        mqtt = Mqtt(Logger(), dispatcher.get_broker('mqtt'), name='test', config=config, config_dir=config_dir)
+        mqtt.client = client or Client()
+        return mqtt
+
+    async def asyncTearDown(self):
+        for task in getattr(self, 'tasks', []):
+            task.cancel()
+
+    def start_publishers(self, mqtt):
+        mqtt.publisher_tasks = [asyncio.create_task(mqtt.publisher()) for _ in range(mqtt.max_inflight)]
+        self.tasks = mqtt.publisher_tasks
+
+
+class MqttOutboundTest(MqttTest):
+    async def test_queue(self):
+        mqtt = self.get_mqtt()
+        await mqtt.on_event_published('sensor', 'value', 10)
+        self.assertEqual(mqtt.client.published, [])
+        self.start_publishers(mqtt)
+        await asyncio.sleep(0.01)
+        self.assertEqual(mqtt.client.published, [('brick/test/sensor/get/value', b'10', True, 1)])
+
+    async def test_latest_value_wins(self):
+        mqtt = self.get_mqtt()
+        await mqtt.on_event_published('sensor', 'value', 10)
+        await mqtt.on_event_published('sensor', 'delay', 5)
+        await mqtt.on_event_published('sensor', 'value', 11)
+        self.start_publishers(mqtt)
+        await asyncio.sleep(0.01)
+        self.assertEqual(mqtt.client.published, [
+            ('brick/test/sensor/get/value', b'11', True, 1),
+            ('brick/test/sensor/get/delay', b'5', True, 1),
+        ])
+
+    async def test_not_retained(self):
+        mqtt = self.get_mqtt()
+        mqtt.enqueue('topic', b'1', 0, False)
+        mqtt.enqueue('topic', b'2', 0, False)
+        self.start_publishers(mqtt)
+        await asyncio.sleep(0.01)
+        self.assertEqual([x[1] for x in mqtt.client.published], [b'1', b'2'])
+
+    async def test_inflight_window(self):
+        mqtt = self.get_mqtt(client=Client(delay=0.01), max_inflight=3)
+        self.start_publishers(mqtt)
+        for number in range(10):
+            await mqtt.on_event_published('sensor', 'value{}'.format(number), number)
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(mqtt.client.published), 10)
+        self.assertEqual(mqtt.client.max_inflight, 3)
+
+    async def test_queue_full(self):
+        mqtt = self.get_mqtt(queue_size=2)
+        for number in range(4):
+            await mqtt.on_event_published('sensor', 'value{}'.format(number), number)
+        self.assertEqual(mqtt.dropped, 2)
+        self.assertEqual(mqtt.log.logged, [('warning', 'Outbound queue full (1 dropped)')])
+        self.start_publishers(mqtt)
+        await asyncio.sleep(0.01)
+        self.assertEqual([x[1] for x in mqtt.client.published], [b'2', b'3'])
+
+
+class MqttPolicyTest(MqttTest):
+    async def test_default(self):
+        mqtt = self.get_mqtt()
+        self.assertEqual(mqtt.get_policy('sensor', 'value'), (1, True))
+        self.assertEqual(mqtt.get_client_config()['default_qos'], 1)
+
+    async def test_policy(self):
+        mqtt = self.get_mqtt(qos=0, policy=[
+            dict(topic='value', qos=0, retain=False),
+            dict(device='relay', topic='power', qos=2),
+            dict(device='sensor', retain='no'),
+        ])
+        self.assertEqual(mqtt.get_policy('sensor', 'value'), (0, False))
+        self.assertEqual(mqtt.get_policy('relay', 'power'), (2, True))
+        self.assertEqual(mqtt.get_policy('relay', 'delay'), (0, True))
+        self.assertEqual(mqtt.get_policy('sensor', 'delay'), (0, False))
+        self.assertEqual(mqtt.get_route('relay', 'power'), ('brick/test/relay/get/power', 2, True))
+        self.assertEqual(mqtt.routes[('relay', 'power')], ('brick/test/relay/get/power', 2, True))
+
+    async def test_publish(self):
+        mqtt = self.get_mqtt(policy=[dict(topic='value', qos=0, retain=False)])
+        await mqtt.on_event_published('sensor', 'value', 10)
+        await mqtt.on_event_published('sensor', 'delay', 5)
+        self.start_publishers(mqtt)
+        await asyncio.sleep(0.01)
+        self.assertEqual(mqtt.client.published, [
+            ('brick/test/sensor/get/value', b'10', False, 0),
+            ('brick/test/sensor/get/delay', b'5', True, 1),
+        ])
+
+    async def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.get_mqtt(policy=[dict(topic='value', qos=3)])
+        with self.assertRaises(ValidationError):
+            self.get_mqtt(policy=[dict(topic='#/value')])
+        with self.assertRaises(ValidationError):
+            self.get_mqtt(policy=[dict(topic='value', wrong=1)])
+
+
+class SpoolTest(unittest.IsolatedAsyncioTestCase):
+    async def test_append_pop(self):
+        with TemporaryDirectory() as config_dir:
+            spool = Spool(os.path.join(config_dir, 'spool'))
+            await spool.append([('a', b'1', 1, False), ('b', b'1', 1, True)])
+            await spool.append([('a', b'2', 1, False), ('b', b'2', 1, True)])
+            self.assertEqual(Spool(spool.file_name).size, spool.size)
+            self.assertEqual(await spool.pop(), [('a', b'1', 1, False), ('a', b'2', 1, False), ('b', b'2', 1, True)])
+            self.assertEqual(spool.size, 0)
+            self.assertFalse(os.path.exists(spool.file_name))
+            self.assertEqual(await spool.pop(), [])
+
+    async def test_compaction(self):
+        with TemporaryDirectory() as config_dir:
+            spool = Spool(os.path.join(config_dir, 'spool'), max_size=400)
+            for number in range(40):
+                await spool.append([('value', str(number).encode(), 1, True)])
+            self.assertEqual(await spool.pop(), [('value', b'39', 1, True)])
+
+    async def test_max_size(self):
+        with TemporaryDirectory() as config_dir:
+            spool = Spool(os.path.join(config_dir, 'spool'), max_size=400)
+            for number in range(40):
+                await spool.append([('value', str(number).encode(), 1, False)])
+            self.assertLessEqual(spool.size, 400)
+            messages = await spool.pop()
+            self.assertEqual(messages[-1], ('value', b'39', 1, False))
+            self.assertLess(len(messages), 40)
+
+    async def test_restore(self):
+        with TemporaryDirectory() as config_dir:
+            spool = Spool(os.path.join(config_dir, 'spool'))
+            await spool.append([('b', b'1', 1, True)])
+            await spool.restore([('a', b'1', 1, True), ('b', b'0', 1, True)])
+            self.assertEqual(await spool.pop(), [('a', b'1', 1, True), ('b', b'1', 1, True)])
+
+
+class MqttSpoolTest(MqttTest):
+    async def test_disconnected(self):
+        with TemporaryDirectory() as config_dir:
+            mqtt = self.get_mqtt(config_dir=config_dir)
+            mqtt.client.is_connected = False
+            self.start_publishers(mqtt)
+            await mqtt.on_event_published('sensor', 'value', 10)
+            await mqtt.on_event_published('sensor', 'delay', 5)
+            await asyncio.sleep(0.01)
+            await mqtt.on_event_published('sensor', 'value', 11)
+            await asyncio.sleep(0.01)
+            self.assertEqual(mqtt.client.published, [])
+            mqtt.client.is_connected = True
+            await mqtt.replay()
+            self.assertEqual(mqtt.client.published, [
+                ('brick/test/sensor/get/delay', b'5', True, 1),
+                ('brick/test/sensor/get/value', b'11', True, 1),
+            ])
+            self.assertEqual(mqtt.spool.size, 0)
+
+    async def test_replay_skip_fresh(self):
+        with TemporaryDirectory() as config_dir:
+            mqtt = self.get_mqtt(config_dir=config_dir)
+            await mqtt.spool.append([('brick/test/sensor/get/value', b'10', 1, True), ('other', b'1', 0, False)])
+            mqtt.fresh_topics.add('brick/test/sensor/get/value')
+            await mqtt.replay()
+            self.assertEqual(mqtt.client.published, [('other', b'1', False, 0)])
+
+    async def test_replay_rate(self):
+        with TemporaryDirectory() as config_dir:
+            mqtt = self.get_mqtt(config_dir=config_dir, spool_rate=2)
+            await mqtt.spool.append([('topic', str(x).encode(), 0, False) for x in range(3)])
+            task = asyncio.create_task(mqtt.replay())
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(mqtt.client.published), 2)
+            task.cancel()
+
+    async def test_no_config_dir(self):
+        self.assertIsNone(self.get_mqtt().spool)
+
+
+class MqttMessageTest(MqttTest):
+    async def asyncSetUp(self):
+        self.callback = Callback()
+        dispatcher = Dispatcher(Logger())
+        dispatcher.get_broker('relay', self.callback.function)
+        self.mqtt = Mqtt(Logger(), dispatcher.get_broker('mqtt'), name='test')
+
+    async def test_on_message(self):
+        await self.mqtt.on_message('brick/test/relay/set/power', 'on')
+        await self.mqtt.on_message('brick/test/relay/set/config/delay', '10')
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.callback.called, [
+            dict(sender='mqtt', topic='power', payload='on'),
+            dict(sender='mqtt', topic='config/delay', payload='10'),
+        ])
+
+    async def test_on_message_discarded(self):
+        await self.mqtt.on_message('brick/test/relay/get/power', 'on')
+        await self.mqtt.on_message('brick/test/relay/set/', 'on')
+        await self.mqtt.on_message('brick/test/other/set/power', 'on')
+        await self.mqtt.on_message('brick/other/relay/set/power', 'on')
+        await self.mqtt.on_message('brick/test', 'on')
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.callback.called, [])
+
+    async def test_encode_payload(self):
+        self.assertEqual(self.mqtt.encode_payload('on'), b'on')
+        self.assertIs(self.mqtt.encode_payload('on'), self.mqtt.encode_payload('on'))
+        self.assertEqual(self.mqtt.encode_payload(True), b'True')
+        self.assertEqual(self.mqtt.encode_payload(1), b'1')
+        self.assertEqual(self.mqtt.payload_cache, dict(on=b'on'))
+
+
+class MqttSnapshotTest(MqttTest):
+    async def asyncSetUp(self):
+        self.dispatcher = Dispatcher(Logger())
+        self.devices = dict()
+        for name in ['sensor', 'relay']:
+            device = Device()
+            device.log = Logger()
+            device.broker = self.dispatcher.get_broker(name, callback=device._message_received)
+            await device._setup()
+            self.devices[name] = device
+        self.devices['sensor'].set_state('value', Decimal('10.5'))
+        self.devices['sensor'].set_state('delay', 5)
+        self.devices['relay'].set_state('value', True)
+        await asyncio.sleep(0.01)
+
+    def get_mqtt(self, **config):
+        mqtt = Mqtt(Logger(), self.dispatcher.get_broker('mqtt'), name='test', config=config)
+        mqtt.client = Client()
+        for component in mqtt.available_components:
+            mqtt.broker.subscribe(mqtt.on_event_published, sender=component)
+        self.start_publishers(mqtt)
+        return mqtt
+
+    async def publish_state(self, mqtt):
+        if mqtt.snapshot:
+            await mqtt.broker.publish(topic='publish_snapshot')
+        if mqtt.snapshot_individual or not mqtt.snapshot:
+            await mqtt.broker.publish(topic='publish_state')
+        await asyncio.sleep(0.01)
+        return [x for x in mqtt.client.published if not x[0].startswith('brick/test/mqtt/')]
+
+    def test_device_snapshot_cache(self):
+        device = self.devices['sensor']
+        self.assertEqual(device.get_snapshot(), '{"value":"10.5","delay":5}')
+        self.assertIs(device.get_snapshot(), device.get_snapshot())
+        device.set_state('delay', 6)
+        self.assertEqual(device.get_snapshot(), '{"value":"10.5","delay":6}')
+
+    async def test_disabled(self):
+        mqtt = self.get_mqtt()
+        published = await self.publish_state(mqtt)
+        self.assertEqual(sorted([x[0] for x in published]), [
+            'brick/test/relay/get/value',
+            'brick/test/sensor/get/delay',
+            'brick/test/sensor/get/value',
+        ])
+
+    async def test_device(self):
+        mqtt = self.get_mqtt(snapshot='device')
+        published = await self.publish_state(mqtt)
+        self.assertEqual(sorted(published), [
+            ('brick/test/relay/get/snapshot', b'{"value":true}', True, 1),
+            ('brick/test/sensor/get/snapshot', b'{"value":"10.5","delay":5}', True, 1),
+        ])
+
+    async def test_brick(self):
+        mqtt = self.get_mqtt(snapshot='brick', snapshot_topic='devices')
+        published = await self.publish_state(mqtt)
+        self.assertEqual(published, [(
+            'brick/test/brick/get/devices', b'{"relay":{"value":true},"sensor":{"value":"10.5","delay":5}}', True, 1)])
+
+    async def test_individual(self):
+        mqtt = self.get_mqtt(snapshot='device', snapshot_individual=True)
+        published = await self.publish_state(mqtt)
+        self.assertEqual(len(published), 5)
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.get_mqtt(snapshot='all')
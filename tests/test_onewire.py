@@ -0,0 +1,154 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from .test import Callback, HardwareManager, Logger
+os.environ['W1THERMSENSOR_NO_KERNEL_MODULE'] = '1'
+from brick.device.onewire import DS18x20
+from brick.exceptions import ValidationError
+from brick.hardware.onewire import OneWireBus
+from brick.message import Dispatcher
+
+
+SENSORS = {'28-000000000001': 21500, '28-000000000002': -1250, '10-000000000003': 85000}
+
+
+class Kernel:
+    # w1 sysfs tree, a trigger written to the master converts every sensor
+    def __init__(self, directory, bulk_read=True):
+        self.directory = directory
+        self.master = os.path.join(directory, 'w1_bus_master1')
+        self.bulk_read = bulk_read
+        self.triggers = 0
+        self.temperatures = dict(SENSORS)
+        os.mkdir(self.master)
+        self.write(os.path.join(self.master, 'w1_master_slaves'), '\n'.join(list(SENSORS) + ['01-000000000004']) + '\n')
+        for sensor_id, value in SENSORS.items():
+            os.mkdir(os.path.join(directory, sensor_id))
+            self.write(os.path.join(directory, sensor_id, 'temperature'), '0\n')
+            self.write(os.path.join(directory, sensor_id, 'w1_slave'), (
+                '2d 00 4b 46 ff ff 04 10 b3 : crc=b3 YES\n'
+                '2d 00 4b 46 ff ff 04 10 b3 t={}\n'.format(value)
+            ))
+        if bulk_read:
+            self.write(os.path.join(self.master, 'therm_bulk_read'), '0\n')
+
+    def write(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def write_master(self, name, value):
+        # sysfs attribute store: reads never return what was written
+        assert (name, value) == ('therm_bulk_read', 'trigger')
+        self.triggers += 1
+        self.write(os.path.join(self.master, name), '-1\n')
+
+    async def run(self):
+        path = os.path.join(self.master, 'therm_bulk_read')
+        while True:
+            await asyncio.sleep(0.005)
+            if self.read(path).strip() == '-1':
+                await asyncio.sleep(0.06)
+                for sensor_id, value in self.temperatures.items():
+                    self.write(os.path.join(self.directory, sensor_id, 'temperature'), '{}\n'.format(value))
+                self.write(path, '1\n')
+
+
+class OneWireBusTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kernel = Kernel(self.directory.name)
+        self.kernel_task = asyncio.create_task(self.kernel.run())
+        self.bus = OneWireBus(base_directory=self.directory.name, max_age=0.5)
+        self.bus.log = Logger()
+        self.bus.write_master = self.kernel.write_master
+
+    async def asyncTearDown(self):
+        self.kernel_task.cancel()
+        self.directory.cleanup()
+
+    async def test_sensors(self):
+        self.assertEqual(await self.bus.get_sensors(), list(SENSORS))
+
+    async def test_bulk_read(self):
+        for sensor_id in SENSORS:
+            self.bus.attach(sensor_id)
+        temperatures = await asyncio.gather(*[self.bus.get_temperature(sensor_id) for sensor_id in SENSORS])
+        self.assertEqual(temperatures, [21.5, -1.25, 85])
+        # One conversion for the whole bus, shared within max_age
+        self.assertEqual(self.kernel.triggers, 1)
+        self.kernel.temperatures['28-000000000001'] = 22000
+        self.assertEqual(await self.bus.get_temperature('28-000000000001'), 21.5)
+        self.assertEqual(self.kernel.triggers, 1)
+        await asyncio.sleep(0.5)
+        self.assertEqual(await self.bus.get_temperature('28-000000000001'), 22)
+        self.assertEqual(self.kernel.triggers, 2)
+
+    async def test_sensor_error(self):
+        self.bus.attach('28-000000000001')
+        self.bus.attach('28-000000000009')
+        with self.assertRaises(FileNotFoundError):
+            await self.bus.get_temperature('28-000000000009')
+        self.assertEqual(await self.bus.get_temperature('28-000000000001'), 21.5)
+        self.assertEqual(self.kernel.triggers, 1)
+
+    async def test_timeout(self):
+        self.kernel_task.cancel()
+        bus = OneWireBus(base_directory=self.directory.name, timeout=0.1)
+        bus.write_master = self.kernel.write_master
+        bus.attach('28-000000000001')
+        with self.assertRaises(asyncio.TimeoutError):
+            await bus.get_temperature('28-000000000001')
+
+    async def test_without_bulk_read(self):
+        os.remove(os.path.join(self.kernel.master, 'therm_bulk_read'))
+        self.bus.attach('28-000000000002')
+        self.assertEqual(await self.bus.get_temperature('28-000000000002'), -1.25)
+
+
+class DS18x20Test(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kernel = Kernel(self.directory.name)
+        self.kernel_task = asyncio.create_task(self.kernel.run())
+        self.bus = OneWireBus(base_directory=self.directory.name)
+        self.bus.log = Logger()
+        self.bus.write_master = self.kernel.write_master
+        self.dispatcher = Dispatcher(Logger())
+        self.callback = Callback()
+
+    async def asyncTearDown(self):
+        self.kernel_task.cancel()
+        self.directory.cleanup()
+
+    def get_sensor(self, name, **hardware):
+        sensor = DS18x20(
+            hardware_manager=HardwareManager(onewire=self.bus),
+            hardware=dict(type='OneWire', device='onewire', **hardware),
+            precision=2, delay=3600,
+        )
+        sensor.log = Logger()
+        sensor.broker = self.dispatcher.get_broker(name, callback=sensor._message_received)
+        self.dispatcher.get_broker('test').subscribe(self.callback.function, sender=name)
+        return sensor
+
+    def test_validation(self):
+        with self.assertRaises(ValidationError):
+            DS18x20(hardware=dict(type='W1'))
+
+    async def test_bulk_read(self):
+        sensors = [self.get_sensor('temp_{}'.format(index), sensor_id=sensor_id) for index, sensor_id in enumerate(SENSORS)]
+        sensors.append(self.get_sensor('first'))
+        for sensor in sensors:
+            await sensor.start()
+        await asyncio.sleep(0.2)
+        for sensor in sensors:
+            await sensor.stop()
+        values = dict([(x['sender'], x['payload']) for x in self.callback.called if x['topic'] == 'value'])
+        self.assertEqual(values, {'temp_0': 21.5, 'temp_1': -1.25, 'temp_2': 85, 'first': 21.5})
+        self.assertEqual(self.kernel.triggers, 1)
+        self.assertEqual(self.bus.sensors, set())
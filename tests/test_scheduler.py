@@ -0,0 +1,155 @@
+import asyncio
+import unittest
+from .test import Logger
+from brick.device.scheduler import Scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+
+class Job:
+    def __init__(self, clock):
+        self.clock = clock
+        self.called = []
+        self.running = None
+
+    async def function(self):
+        self.called.append(self.clock.now)
+        if self.running:
+            await self.running
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log = Logger()
+        self.clock = Clock()
+
+    def get_scheduler(self, **kwargs):
+        # Driven by a fake clock, one second per tick, without the run task
+        self.scheduler = Scheduler(self.log, tick=1, **kwargs)
+        self.scheduler.time = self.clock.time
+        self.scheduler.start_time = 0
+        return self.scheduler
+
+    async def advance(self, seconds):
+        for _ in range(seconds):
+            self.clock.now += 1
+            self.scheduler.run_pending()
+            for _ in range(3):
+                await asyncio.sleep(0)
+
+    async def test_periodic(self):
+        scheduler = self.get_scheduler()
+        job = Job(self.clock)
+        scheduler.add_job('job', job.function, 2)
+        await self.advance(10)
+        self.assertEqual(job.called, [1, 3, 5, 7, 9])
+        self.assertEqual(scheduler.get_stats()['job']['missed'], 0)
+
+    async def test_first_run(self):
+        scheduler = self.get_scheduler()
+        jobs = [Job(self.clock) for _ in range(4)]
+        for index, job in enumerate(jobs):
+            scheduler.add_job('job{}'.format(index), job.function, 60)
+        await self.advance(1)
+        # Spreading does not delay the first reading
+        self.assertEqual([job.called for job in jobs], [[1]] * 4)
+
+    async def test_same_tick(self):
+        scheduler = self.get_scheduler(spread=False)
+        jobs = [Job(self.clock) for _ in range(3)]
+        for index, job in enumerate(jobs):
+            scheduler.add_job('job{}'.format(index), job.function, 3)
+        self.assertEqual(len(scheduler.wheel), 1)
+        await self.advance(4)
+        self.assertEqual([job.called for job in jobs], [[1, 4]] * 3)
+
+    async def test_spread(self):
+        scheduler = self.get_scheduler()
+        jobs = [Job(self.clock) for _ in range(4)]
+        for index, job in enumerate(jobs):
+            scheduler.add_job('job{}'.format(index), job.function, 10)
+        await self.advance(21)
+        seconds = [job.called[1] for job in jobs]
+        self.assertEqual(len(set(seconds)), 4)
+        self.assertLessEqual(max(seconds), 11)
+        # Then one interval apart
+        self.assertEqual([job.called[2] - job.called[1] for job in jobs], [10] * 4)
+
+    async def test_jitter(self):
+        scheduler = self.get_scheduler(spread=False, jitter=5)
+        for index in range(20):
+            scheduler.add_job('job{}'.format(index), Job(self.clock).function, 10)
+        ticks = [job.tick for job in scheduler.jobs.values()]
+        self.assertGreater(len(set(ticks)), 1)
+        self.assertLessEqual(max(ticks) - min(ticks), 5)
+
+    async def test_missed_deadline(self):
+        scheduler = self.get_scheduler()
+        job = Job(self.clock)
+        job.running = asyncio.get_running_loop().create_future()
+        scheduler.add_job('slow', job.function, 2)
+        await self.advance(10)
+        self.assertEqual(job.called, [1])
+        self.assertEqual(scheduler.get_stats()['slow']['missed'], 4)
+        self.assertEqual(self.log.logged, [('warning', 'Missed deadline - slow (1 missed)')])
+        job.running.set_result(None)
+        await asyncio.sleep(0)
+        await self.advance(2)
+        self.assertEqual(job.called, [1, 11])
+
+    async def test_callable_interval(self):
+        scheduler = self.get_scheduler()
+        job = Job(self.clock)
+        interval = [2]
+        scheduler.add_job('job', job.function, lambda: interval[0])
+        await self.advance(5)
+        self.assertEqual(job.called, [1, 3, 5])
+        interval[0] = 100
+        await self.advance(50)
+        self.assertEqual(job.called, [1, 3, 5, 7])
+
+    async def test_run_every(self):
+        scheduler = self.get_scheduler()
+        job = Job(self.clock)
+        task = asyncio.create_task(scheduler.run_every('job', job.function, 1))
+        await asyncio.sleep(0)
+        self.assertIn('job', scheduler.jobs)
+        await self.advance(3)
+        task.cancel()
+        await asyncio.sleep(0)
+        self.assertNotIn('job', scheduler.jobs)
+        await self.advance(3)
+        self.assertEqual(job.called, [1, 2, 3])
+
+    async def test_error(self):
+        scheduler = self.get_scheduler(retry=10)
+        job_log = Logger()
+        called = []
+        async def error():
+            called.append(self.clock.now)
+            raise Exception('error')
+        scheduler.add_job('error', error, 1, log=job_log)
+        await self.advance(15)
+        # Logged by the job owner, then retried after a back-off
+        self.assertEqual(called, [1, 11])
+        self.assertEqual(job_log.logged, [('exception', 'loop error')] * 2)
+        self.assertEqual(self.log.logged, [])
+        self.assertEqual(scheduler.get_stats()['error']['runs'], 0)
+
+    async def test_run_task(self):
+        scheduler = Scheduler(self.log, tick=0.01)
+        scheduler.start()
+        called = []
+        async def job():
+            called.append(None)
+        scheduler.add_job('job', job, 0.01)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        # Real clock: only a loose bound
+        self.assertGreaterEqual(len(called), 2)